@@ -1,12 +1,27 @@
 #!/usr/bin/env python3
 
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from datetime import datetime
+from threading import Lock
+from time import monotonic
 import json
 import logging
 import os.path
+import sys
+import mysql.connector
 from PyInquirer import style_from_dict, Token, prompt
 from PyInquirer import Validator, ValidationError
-import pyoomysql
+
+# Add current path
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if not path in sys.path:
+  sys.path.insert(1, path)
+del path
+
+import mysqllib
+import mysqllib_inventory
 
 # Instantiate Logger
 logging.basicConfig(
@@ -110,6 +125,10 @@ targets_options = [
                 "key": "e",
                 "name": "Load Targets based on environment",
                 "value": "load-from-env"
+            },{
+                "key": "s",
+                "name": "Select loaded targets by tag (env=prd role=replica shard=3)",
+                "value": "select-by-tag"
             },{
                 "key": "c",
                 "name": "Clear Targets",
@@ -155,9 +174,13 @@ load_targets_form = [
                 "key": "j",
                 "name": "JSON ( { hostname: <hostname>, port: <port> } )",
                 "value": "json"
+            },{
+                "key": "y",
+                "name": "YAML ( same layouts as JSON )",
+                "value": "yaml"
             },{
                 "key": "p",
-                "name": "Plain Text ( <hostname>:<port> ) (1 entry per line)",
+                "name": "Plain Text ( <hostname>:<port> [tag=value ...] ) (1 entry per line)",
                 "value": "plain-text"
             }
         ]
@@ -168,6 +191,15 @@ load_targets_form = [
     }
 ]
 
+## Target Select by tag Form ##
+select_targets_form = [
+    {
+        "type": "input",
+        "name": "tags",
+        "message": "Tags to match (tag=value[,value] ...): "
+    }
+]
+
 ## Target Load from env Form ##
 load_targets_env_form = [
     {
@@ -345,36 +377,57 @@ run_command = [
         "type": "confirm",
         "name": "run_everywhere",
         "message": "Run also in replicas?: "
+    },{
+        "type": "input",
+        "name": "concurrency",
+        "message": "Targets to run on at the same time: ",
+        "default": "8",
+        "validate": lambda val: val.isdigit() and int(val) > 0 or "Please enter a positive number",
+        "filter": lambda val: int(val) if val.isdigit() else val
+    },{
+        "type": "confirm",
+        "name": "stop_on_failure",
+        "message": "Cancel the remaining targets on the first failure?: ",
+        "default": False
+    },{
+        "type": "confirm",
+        "name": "by_address",
+        "message": "Connect to the resolved IP addresses instead of the hostnames (no TLS hostname checks)?: ",
+        "default": False
+    },{
+        "type": "input",
+        "name": "output",
+        "message": "Save the results to (JSON file, empty to only print): "
     }
 ]
 
 ### FUNCTIONS ###
-def load_targets(file_path: str, file_type: str):
+def load_targets(file_path: str, file_type: str, inventory=None, tags: dict = None):
+    # Loads the file into the inventory (deduplicated, tags indexed, hostnames resolved)
+    # and returns its targets. file_type None guesses it from the extension
     logger = logging.getLogger("load_targets")
     logger.debug("Entering load_targets)")
-    targets_list = []
+    inventory = inventory if inventory is not None else mysqllib_inventory.Inventory()
     try:
-        if file_type.lower() == "json":
-            logger.debug("Trying to open JSON file")
-            with open(file_path,"r") as targets_file:
-                targets_dict = json.load(targets_file)
-                for host in targets_dict.keys():
-                    targets_list.append({"host": host,"port":targets_dict[host]})
-        else:
-            logger.debug("Trying to open plan-text file")
-            with open(file_path,"r") as targets_file:
-                for line in targets_file.readlines():
-                    splitted = line.split(":")
-                    target = {splitted[0].replace("\n","") : int(("3306" if len(splitted) < 2 else splitted[1]).replace("\n",""))}
-                    logger.debug(f"Adding {target}")
-                    targets_list.append(target)
+        logger.debug(f"Trying to open {file_type} file")
+        inventory.load(file_path, file_type=file_type, tags=tags)
+        inventory.resolve()
     # Handle Exceptions
     except Exception as err:
         print(err)
         logger.warning(err)
+    targets_list = list(inventory)
     logger.debug(targets_list)
     return targets_list
 
+def parse_tags(text: str):
+    # "env=prd role=replica shard=1,3" -> {"env": ["prd"], "role": ["replica"], "shard": ["1", "3"]}
+    tags = {}
+    for word in text.split():
+        tag, _, values = word.partition("=")
+        tags[tag] = values.split(",")
+    return tags
+
 
 def print_current_info(db_list, credentials):
     print("==================================")
@@ -383,11 +436,106 @@ def print_current_info(db_list, credentials):
 
 def beautify_output(payload):
     try:
-        beautified = json.dumps(payload)
+        beautified = json.dumps(payload, indent=2, default=str)
         return beautified
     except:
         return payload
 
+def run_on_target(target: dict, credentials: dict, policy, command: str = None, script: str = None, by_address: bool = False):
+    logger = logging.getLogger("run_on_target")
+    result = {"host": target["host"], "port": target["port"], "status": "OK"}
+    start = monotonic()
+    # Connected to by name so TLS hostname checks and host name grants keep working, the resolved
+    # address only when asked for. Results keep the host name either way
+    db = mysqllib.Database(hostname=((by_address and target.get("address")) or target["host"]), port=target["port"])
+    db.connect(username=credentials["user"], password=credentials["pswd"], pool_size=1)
+    try:
+        if not db.is_connected():
+            result["status"] = "FAILED"
+            result["error"] = f"Couldn't connect to {target['host']}"
+        elif not policy.allows_host(db.is_replica()):
+            result["status"] = "SKIPPED"
+            result["error"] = "Not running here since this is a replica"
+        elif command is not None:
+            if not policy.allows(command, db.is_replica()):
+                result["status"] = "SKIPPED"
+                result["error"] = "Not running writes on a replica"
+            else:
+                # execute_on raises, so failures are reported instead of coming back as an empty response.
+                # Committed here, the pool rolls back whatever is still open when the connection returns
+                with db.pool.connection() as pooled:
+                    result["response"] = db.execute_on(pooled, command, commit=True)
+        else:
+            if not all(policy.allows(statement, db.is_replica()) for statement in mysqllib.split_sql(script.splitlines(True))):
+                result["status"] = "SKIPPED"
+                result["error"] = "Not running writes on a replica"
+            else:
+                result["response"] = db.run(script=script)
+                if result["response"] is None or result["response"]["errors"] or result["response"]["status"] != "completed":
+                    result["status"] = "FAILED"
+    except mysql.connector.Error as err:
+        logger.debug(f"{target['host']}: {err}")
+        result["status"] = "FAILED"
+        result["error"] = err.msg
+    finally:
+        if db.is_connected():
+            db.disconnect()
+    result["seconds"] = round(monotonic() - start, 3)
+    return result
+
+def run_on_targets(targets: list, credentials: dict, policy, command: str = None, script: str = None, concurrency: int = 8, stop_on_failure: bool = False, by_address: bool = False):
+    # Fans the command/script out to the targets, concurrency at a time, and prints a line per
+    # target as it starts and finishes. Returns one document with every target's result
+    logger = logging.getLogger("run_on_targets")
+    started = monotonic()
+    results = [None] * len(targets)
+    print_lock = Lock()
+    progress = {"running": 0, "done": 0}
+
+    def run(index, target):
+        with print_lock:
+            progress["running"] += 1
+            print(f"[{progress['done']}/{len(targets)}] {target['host']}:{target['port']} started ({progress['running']} running)")
+        try:
+            return run_on_target(target, credentials, policy, command=command, script=script, by_address=by_address)
+        finally:
+            with print_lock:
+                progress["running"] -= 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(run, index, target): index for index, target in enumerate(targets)}
+        for future in as_completed(futures):
+            index = futures[future]
+            if future.cancelled():
+                continue
+            try:
+                results[index] = future.result()
+            except Exception as err:
+                logger.error(err)
+                results[index] = {"host": targets[index]["host"], "port": targets[index]["port"], "status": "FAILED", "error": str(err)}
+            with print_lock:
+                progress["done"] += 1
+                print(f"[{progress['done']}/{len(targets)}] {results[index]['host']}:{results[index]['port']} {results[index]['status']} in {results[index].get('seconds', 0):.2f}s")
+            if stop_on_failure and results[index]["status"] == "FAILED":
+                cancelled = [other for other in futures if other.cancel()]
+                if cancelled:
+                    logger.warning(f"Cancelling {len(cancelled)} remaining targets after the failure on {results[index]['host']}")
+    for index, target in enumerate(targets):
+        if results[index] is None:
+            results[index] = {"host": target["host"], "port": target["port"], "status": "CANCELLED"}
+    summary = {}
+    for result in results:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    return {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "command": command,
+        "script": script is not None,
+        "targets": len(targets),
+        "summary": summary,
+        "seconds": round(monotonic() - started, 3),
+        "results": results
+    }
+
 ### GLOBAL VARIABLES ###
 target_db_list = []
 
@@ -397,6 +545,7 @@ target_db_list = []
 def main():
     answer="Nothing"
     target_db_list = []
+    inventory = mysqllib_inventory.Inventory()
     credentials = {
         "user": None,
         "pswd": None
@@ -415,48 +564,47 @@ def main():
                 if answer == "add-target":
                     print_current_info(target_db_list, credentials)
                     answer = prompt(target_form, style=style)
-                    target_db_list.append(
-                        {
-                            "host": answer["Hostname"],
-                            "port": answer["Port"],
-                            "vendor": "mysql"
-                        }
-                    )
+                    try:
+                        target = inventory.add(answer["Hostname"], answer["Port"], vendor="mysql")
+                        if target not in target_db_list:
+                            target_db_list.append(target)
+                    except ValueError as err:
+                        print(f"ERROR: {err}")
                     answer = "back"
                 # Target Removal
                 elif answer == "remove-target":
                     print_current_info(target_db_list, credentials)
                     answer = prompt(target_form, style=style)
                     try:
-                        target_db_list.remove(
-                            {
-                                "host": answer["Hostname"],
-                                "port": answer["Port"],
-                                "vendor": "mysql"
-                            }
-                        )
-                    except Exception as err:
-                        if str(err) == "list.remove(x): x not in list":
-                            print("ERROR: Target not in list")
-                        # print(f"Error: {error}")
+                        target_db_list.remove(inventory.remove(answer["Hostname"], answer["Port"]))
+                    except ValueError:
+                        print("ERROR: Target not in list")
                     answer = "back"
                 # Load Targets from File
                 elif answer == "load-from-file":
                     print_current_info(target_db_list, credentials)
                     answer = prompt(load_targets_form, style=style)
                     logger.debug(f"Answers: {answer['path']} | {answer['file_type']}")
-                    target_db_list = load_targets(file_path = answer["path"], file_type=(answer["file_type"] or 3306))
+                    target_db_list = load_targets(file_path = answer["path"], file_type=answer["file_type"], inventory=inventory)
                     answer = "back"
             # Load Targets from File
                 elif answer == "load-from-env":
                     print_current_info(target_db_list, credentials)
                     answer = prompt(load_targets_env_form, style=style)
-                    target_db_list = load_targets(file_path = answer["path"], file_type="json")
+                    inventory.clear()
+                    target_db_list = load_targets(file_path = answer["path"], file_type=None, inventory=inventory, tags={"env": answer["environment"]})
+                    answer = "back"
+            # Select Targets by tag
+                elif answer == "select-by-tag":
+                    print_current_info(target_db_list, credentials)
+                    answer = prompt(select_targets_form, style=style)
+                    target_db_list = inventory.select(**parse_tags(answer["tags"]))
                     answer = "back"
             # Clear Targets
                 elif answer == "clear-targets":
                     print_current_info(target_db_list, credentials)
                     target_db_list = []
+                    inventory.clear()
                     answer = "back"
         elif answer == "databases":
         # Database/Schema Menu
@@ -485,38 +633,27 @@ def main():
                     if answer == "back":
                         answer = "account"
                         break
-                    elif:
-                        
+                    else:
+                        logger.warning(f"{answer} is not implemented yet")
         elif answer == "run_command":
             answer = prompt(run_command, style=style)
-            if answer["run_type"] == "command":
-                for target in target_db_list:
-                    db = pyoomysql.Database(hostname=target["host"], port=target["port"])
-                    db.connect(user=credentials["user"],password=credentials["pswd"],log_level=logging.INFO)
-                    if db.is_connected():
-                        if not db.is_replica() or answer["run_everywhere"]:
-                            response = db.execute(command=answer["command"])
-                            logger.info(f"Database response:\n{beautify_output(response)}")
-                        else:
-                            logger.info("Not running here since this is a replica")
-                    else:
-                        logger.error(f"Couldn't connect to {db.hostname}")
-                answer = "back"
-            elif answer["run_type"] == "script":
+            # Replicas are only targeted, writes included, when the user asked to run there too
+            policy = mysqllib.ExecutionPolicy(role=("any" if answer["run_everywhere"] else "primary"), allow_replica_writes=answer["run_everywhere"])
+            script = None
+            if answer["run_type"] == "script":
                 if os.path.isfile(answer["path"]):
                     with open(answer["path"],"r") as fd:
                         script = fd.read()
-                    for target in target_db_list:
-                        db = pyoomysql.Database(hostname=target["host"], port=target["port"])
-                        db.connect(user=credentials["user"],password=credentials["pswd"],log_level=logging.DEBUG)
-                        if not db.is_replica() or answer["run_everywhere"]:
-                            response = db.run(script=script)
-                            logger.info(f"Database response:\n{beautify_output(response)}")
-                        else:
-                            logger.info("Not running here since this is a replica")
                 else:
                     logger.error(f"File: '{answer['path']}' not found!!!")
-                answer = "back"
+            if answer["run_type"] == "command" or script is not None:
+                report = run_on_targets(target_db_list, credentials, policy, command=answer.get("command"), script=script, concurrency=answer["concurrency"], stop_on_failure=answer["stop_on_failure"], by_address=answer["by_address"])
+                # Printed rather than logged, the report is the output of the run whatever the log level
+                print(f"Database response:\n{beautify_output(report)}")
+                if answer["output"]:
+                    with open(answer["output"], "w") as fd:
+                        json.dump(report, fd, indent=2, default=str)
+            answer = "back"
 
 ############################################################################
 #                                      END                                 #
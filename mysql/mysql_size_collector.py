@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+mysql_size_collector.py:
+  Collects schema/table sizes and row estimates from one or more databases into a
+  local SQLite time series, and reports growth rates for capacity planning
+
+Requirements:
+  - Python 3
+  - mysql-connector-python
+  - mysqllib
+"""
+
+__version__     = "1.0"
+__author__      = "Jesus Alejandro Sanchez Davila"
+__maintainer__  = "Jesus Alejandro Sanchez Davila"
+__email__       = "jsanchez.consultant@gmail.com"
+__status__      = "Alpha"
+
+import mysqllib
+import mysql.connector
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from getpass import getpass
+from time import time
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+# Add current path
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if not path in sys.path:
+  sys.path.insert(1, path)
+del path
+
+logger = logging.getLogger()
+
+# Argument Parser
+parser = ArgumentParser()
+parser.add_argument('-d', '--databases', dest='dbList', nargs='+', required=True, help='List of databases to connect to')
+parser.add_argument('-P', '--port', dest='dbPort', default=3306, help='Port to connect to the databases')
+parser.add_argument('-u', '--user', dest='dbUser', required=True, help='Username to connect to the databases')
+parser.add_argument('-p', '--password', dest='askForPassword', action='store_true', help='Ask for the password')
+parser.add_argument('-s', '--store', dest='storePath', default='mysql_sizes.db', help='SQLite file to keep the snapshots in')
+parser.add_argument('-t', '--threads', dest='threads', type=int, default=16, help='Hosts collected concurrently')
+parser.add_argument('--report', dest='reportDays', type=int, help='Print the growth of the last N days instead of collecting')
+
+# Queries
+TABLE_SIZES = """SELECT table_schema AS schema_name, table_name AS table_name, engine AS engine, table_rows AS table_rows,
+    data_length AS data_bytes, index_length AS index_bytes, data_free AS free_bytes
+FROM information_schema.tables
+WHERE table_type = 'BASE TABLE' AND table_schema NOT IN ('mysql', 'information_schema', 'performance_schema', 'sys')"""
+INDEX_SIZES = """SELECT database_name AS schema_name, table_name AS table_name, index_name AS index_name,
+    stat_value * @@innodb_page_size AS index_bytes
+FROM mysql.innodb_index_stats
+WHERE stat_name = 'size' AND database_name NOT IN ('mysql', 'sys')"""
+
+# Size store class
+class SizeStore:
+    # Narrow SQLite time series: one row per table (and per InnoDB index) per collection
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS table_sizes (host TEXT, port INTEGER, collected_at INTEGER, schema_name TEXT, table_name TEXT, engine TEXT, table_rows INTEGER, data_bytes INTEGER, index_bytes INTEGER, free_bytes INTEGER);
+            CREATE INDEX IF NOT EXISTS table_sizes_host_table ON table_sizes (host, port, schema_name, table_name, collected_at);
+            CREATE TABLE IF NOT EXISTS index_sizes (host TEXT, port INTEGER, collected_at INTEGER, schema_name TEXT, table_name TEXT, index_name TEXT, index_bytes INTEGER);
+            CREATE INDEX IF NOT EXISTS index_sizes_host_table ON index_sizes (host, port, schema_name, table_name, collected_at);
+        """)
+
+    def add(self, snapshot):
+        with self.connection:
+            self.connection.executemany("INSERT INTO table_sizes VALUES (?,?,?,?,?,?,?,?,?,?)", [
+                (snapshot["host"], snapshot["port"], snapshot["collected_at"], row["schema_name"], row["table_name"], row["engine"], integer(row["table_rows"]), integer(row["data_bytes"]), integer(row["index_bytes"]), integer(row["free_bytes"]))
+                for row in snapshot["tables"]
+            ])
+            self.connection.executemany("INSERT INTO index_sizes VALUES (?,?,?,?,?,?,?)", [
+                (snapshot["host"], snapshot["port"], snapshot["collected_at"], row["schema_name"], row["table_name"], row["index_name"], integer(row["index_bytes"]))
+                for row in snapshot["indexes"]
+            ])
+
+    def growth(self, days=30, host=None):
+        # Per table size change between the first and the last snapshot of the window,
+        # with bytes and rows per day, biggest growers first
+        since = int(time()) - days * 86400
+        rows = self.connection.execute("""
+            WITH span AS (
+                SELECT host, port, schema_name, table_name, MIN(collected_at) AS first_at, MAX(collected_at) AS last_at
+                FROM table_sizes WHERE collected_at >= ? AND (? IS NULL OR host = ?)
+                GROUP BY host, port, schema_name, table_name
+            )
+            SELECT w.host, w.port, w.schema_name, w.table_name, w.first_at, w.last_at,
+                l.data_bytes + l.index_bytes AS total_bytes, l.free_bytes, l.table_rows,
+                (l.data_bytes + l.index_bytes) - (f.data_bytes + f.index_bytes) AS bytes_change,
+                l.table_rows - f.table_rows AS rows_change
+            FROM span w
+            JOIN table_sizes f ON f.host = w.host AND f.port = w.port AND f.schema_name = w.schema_name AND f.table_name = w.table_name AND f.collected_at = w.first_at
+            JOIN table_sizes l ON l.host = w.host AND l.port = w.port AND l.schema_name = w.schema_name AND l.table_name = w.table_name AND l.collected_at = w.last_at
+            ORDER BY bytes_change DESC
+        """, (since, host, host)).fetchall()
+        report = []
+        for host_name, port, schema_name, table_name, first_at, last_at, total_bytes, free_bytes, table_rows, bytes_change, rows_change in rows:
+            elapsed_days = (last_at - first_at) / 86400
+            report.append({
+                "host": f"{host_name}:{port}",
+                "table": f"{schema_name}.{table_name}",
+                "total_bytes": total_bytes,
+                "free_bytes": free_bytes,
+                "table_rows": table_rows,
+                "bytes_per_day": bytes_change / elapsed_days if elapsed_days > 0 else 0,
+                "rows_per_day": rows_change / elapsed_days if elapsed_days > 0 else 0
+            })
+        return report
+
+    def schema_totals(self, host=None):
+        # Latest size of every schema
+        return [
+            {"host": f"{host_name}:{port}", "schema": schema_name, "tables": tables, "total_bytes": total_bytes, "free_bytes": free_bytes, "table_rows": table_rows}
+            for host_name, port, schema_name, tables, total_bytes, free_bytes, table_rows in self.connection.execute("""
+                SELECT t.host, t.port, t.schema_name, COUNT(*), SUM(t.data_bytes + t.index_bytes), SUM(t.free_bytes), SUM(t.table_rows)
+                FROM table_sizes t
+                JOIN (SELECT host, port, MAX(collected_at) AS collected_at FROM table_sizes GROUP BY host, port) latest
+                    ON latest.host = t.host AND latest.port = t.port AND latest.collected_at = t.collected_at
+                WHERE ? IS NULL OR t.host = ?
+                GROUP BY t.host, t.port, t.schema_name
+                ORDER BY 5 DESC
+            """, (host, host))
+        ]
+
+    def close(self):
+        self.connection.close()
+
+# Methods
+def integer(value):
+    # The connector returns Decimal for some sizes, SQLite can't bind it
+    return None if value is None else int(value)
+
+def collect(db_host, port, username, password):
+    # One snapshot of a host, two information_schema/mysql queries regardless of the number of tables
+    db = mysqllib.Database(hostname=db_host, port=port, log_level=logging.WARNING)
+    db.connect(username=username, password=password, pool_size=1)
+    if not db.is_connected():
+        return None
+    try:
+        # A failed table query must not be stored as a complete snapshot
+        snapshot = {
+            "host": db_host,
+            "port": int(port),
+            "collected_at": int(time()),
+            "tables": list(db.iter_query(TABLE_SIZES, raise_errors=True)),
+            "indexes": []
+        }
+    except mysql.connector.Error as err:
+        logger.error(f"{db_host}: {err}")
+        db.disconnect()
+        return None
+    try:
+        # mysql.innodb_index_stats often isn't readable by monitoring users, table sizes are kept anyway
+        snapshot["indexes"] = list(db.iter_query(INDEX_SIZES, raise_errors=True))
+    except mysql.connector.Error as err:
+        logger.warning(f"{db_host}: index sizes not collected: {err}")
+    finally:
+        db.disconnect()
+    return snapshot
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    store = SizeStore(args.storePath)
+    if args.reportDays:
+        print(json.dumps({"schemas": store.schema_totals(), "growth": store.growth(days=args.reportDays)}, indent=2))
+    else:
+        dbPswd = 'admin'
+        if args.askForPassword:
+            dbPswd = getpass(prompt='Please enter the password: ')
+        # Snapshots are written by the main thread as hosts finish, SQLite connections are not shared
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            for db_host, snapshot in zip(args.dbList, executor.map(collect, args.dbList, [args.dbPort] * len(args.dbList), [args.dbUser] * len(args.dbList), [dbPswd] * len(args.dbList))):
+                if snapshot is None:
+                    logger.error(f"{db_host}: not collected")
+                    continue
+                store.add(snapshot)
+                logger.info(f"{db_host}: {len(snapshot['tables'])} tables collected")
+    store.close()
@@ -25,8 +25,19 @@ import os
 import mysql.connector
 from mysql.connector import errorcode
 from mysql.connector import FieldType
+from mysqllib import ExecutionPolicy
+from mysqllib import RoleCache
+from mysqllib import probe_replica
+from mysqllib import split_sql
+from mysqllib_inventory import Inventory
 from argparse import ArgumentParser
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from threading import Timer
+from threading import local
+from time import monotonic
 import getpass
 from sys import exit
 parser = ArgumentParser()
@@ -46,6 +57,20 @@ parser.add_argument('--create-user', dest='createUser', action='store_true',
                     help='Creates the user in all target databases.')
 parser.add_argument('--drop-user', dest='dropUser', action='store_true',
                     help='Drops the user in all target databases.')
+parser.add_argument('--parallel', dest='parallel', type=int, default=1,
+                    help='Number of databases to work on at the same time')
+parser.add_argument('--timeout', dest='timeout', type=float, default=None,
+                    help='Seconds a database gets before its connection is cut')
+parser.add_argument('--role', dest='role', default='any', choices=ExecutionPolicy.ROLES,
+                    help='Only run on primaries, only on replicas or on any database (writes are never run on replicas)')
+parser.add_argument('--role-ttl', dest='roleTTL', type=float, default=300,
+                    help='Seconds a database keeps its primary/replica role before it is checked again')
+parser.add_argument('--format', dest='outputFormat', default='table', choices=['table', 'csv', 'tsv', 'jsonl'],
+                    help='Output format for result sets, csv/tsv/jsonl are streamed as rows arrive')
+parser.add_argument('--sample-rows', dest='sampleRows', type=int, default=1000,
+                    help='Rows used to size the columns of the table format')
+parser.add_argument('--connect-by-address', dest='connectByAddress', action='store_true',
+                    help='Connect to the resolved IP addresses instead of the hostnames (no TLS hostname checks, host name grants won\'t match)')
 parser.add_argument("-v", "--verbosity", action="count", default=0)
 # Mutually exclusive arguments
 sar = parser.add_mutually_exclusive_group()
@@ -69,6 +94,10 @@ del path
 VALID_LOG_LEVELS = {'debug', 'log', 'info',
                     'notice', 'warning', 'error', 'critical'}
 
+# Result rendering
+NUMERIC_FIELDS = {'BIGINT', 'DECIMAL', 'DOUBLE', 'FLOAT', 'INT', 'LONG', 'LONGLONG', 'NEWDECIMAL', 'SHORT', 'TINY', 'INT24'}
+SLAVE_STATUS_COLUMNS = ['Slave_IO_State', 'Master_Host', 'Master_User', 'Master_Port', 'Master_Log_File', 'Read_Master_Log_Pos', 'Relay_Log_File', 'Relay_Log_Pos', 'Relay_Master_Log_File', 'Slave_IO_Running', 'Slave_SQL_Running', 'Last_Errno', 'Skip_Counter', 'Exec_Master_Log_Pos', 'Relay_Log_Space', 'Until_Condition', 'Until_Log_Pos', 'Seconds_Behind_Master', 'Last_IO_Errno', 'Last_SQL_Errno']
+
 
 def log(level, msg):
     """
@@ -85,15 +114,19 @@ def log(level, msg):
 # Connect to the database
 
 
-def connect(p_user, p_password, p_host="localhost", p_port="3306", p_database="mysql"):
+def connect(p_user, p_password, p_host="localhost", p_port="3306", p_database="mysql", p_timeout=None):
     """
     connect:
       Function that tries the connection to a database and returns the connection object
     """
     cnx = None
     try:
-        cnx = mysql.connector.connect(
-            user=p_user, password=p_password, host=p_host, database=p_database)
+        if p_timeout:
+            cnx = mysql.connector.connect(
+                user=p_user, password=p_password, host=p_host, port=p_port, database=p_database, connection_timeout=int(max(p_timeout, 1)))
+        else:
+            cnx = mysql.connector.connect(
+                user=p_user, password=p_password, host=p_host, port=p_port, database=p_database)
         if args.verbosity > 3:
             log('debug', "Connected to the " + p_database +
                 " database as the " + p_user + " user")
@@ -135,18 +168,84 @@ def disconnect(cnx):
 # Execute command!
 
 
-def execute(cnx, sql, showSlaveStatus=False):
+def tsv_field(value):
+    """
+    tsv_field:
+      Value escaped the way mysql --batch prints it, NULL as \\N
+    """
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def render_rows(cursor, output_format='table', sample_rows=1000, batch_size=1000):
+    """
+    render_rows:
+      Streams the result set of cursor to stdout in batches of batch_size rows.
+      csv, tsv and jsonl write each batch as soon as it is fetched. table takes its column
+      widths from the first sample_rows rows, longer values further down push their line out
+    """
+    columns = cursor.column_names
+    # Column types are looked up once per result set, not once per cell
+    numeric = [FieldType.get_info(desc[1]) in NUMERIC_FIELDS for desc in cursor.description]
+    if args.verbosity > 3:
+        log('debug', 'Column types ' + str(dict(zip(columns, (FieldType.get_info(desc[1]) for desc in cursor.description)))))
+    if output_format == 'csv':
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(columns)
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            writer.writerows(rows)
+            rows = cursor.fetchmany(batch_size)
+    elif output_format == 'tsv':
+        sys.stdout.write('\t'.join(columns) + '\n')
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            sys.stdout.write(''.join('\t'.join(tsv_field(value) for value in row) + '\n' for row in rows))
+            rows = cursor.fetchmany(batch_size)
+    elif output_format == 'jsonl':
+        rows = cursor.fetchmany(batch_size)
+        while rows:
+            sys.stdout.write(''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in rows))
+            rows = cursor.fetchmany(batch_size)
+    else:
+        sample = cursor.fetchmany(sample_rows)
+        maxLength = [len(column) for column in columns]
+        for row in sample:
+            for i, value in enumerate(row):
+                maxLength[i] = max(maxLength[i], len(str(value)))
+        if args.verbosity > 2:
+            log('log', 'MaxLengths')
+            log('log', dict(zip(columns, maxLength)))
+        # One formatter per column, numbers are right aligned
+        formats = [(str.rjust if numeric[i] else str.ljust, maxLength[i] + 2) for i in range(len(columns))]
+        sys.stdout.write(''.join(column.ljust(width) for column, (align, width) in zip(columns, formats)) + '\n')
+        sys.stdout.write(''.join('-' * width for align, width in formats) + '\n')
+        rows = sample
+        while rows:
+            sys.stdout.write(''.join(''.join(align(str(value), width) for value, (align, width) in zip(row, formats)) + '\n' for row in rows))
+            rows = cursor.fetchmany(batch_size)
+
+
+def execute(cnx, sql, showSlaveStatus=False, isReplica=False):
     """
     execute:
       Given a connection and a SQL, this function executes the SQL in the database associated with the connection
       and returns either a result set or a notification of successful run.
+      isReplica comes from the role cache, writes are refused when it is set.
+      Returns False when the statement failed.
     """
+    success = True
+    cursor = None
     try:
-        cursor = cnx.cursor(buffered=True, dictionary=True)
-        cursor.execute("SHOW SLAVE STATUS;")
-        if cursor.rowcount > 0 and (sql.find("CREATE") == 0 or sql.find("DROP") == 0 or sql.find("ALTER") == 0 or sql.find("GRANT ") == 0 or sql.find("REVOKE") == 0 or sql.find("INSERT") == 0 or sql.find("DELETE") == 0 or sql.find("UPDATE") == 0 or sql.find("IMPORT") == 0 or sql.find("RENAME") == 0):
-            log('error', 'THIS SERVER IS A SLAVE, NO DDL/DML WILL BE RUN HERE!!! ONLY SELECTS ALLOWED!')
+        if not policy.allows(sql, isReplica):
+            if isReplica is None:
+                log('error', 'THE REPLICATION ROLE OF THIS SERVER IS UNKNOWN, NO DDL/DML WILL BE RUN HERE!!! ONLY SELECTS ALLOWED!')
+            else:
+                log('error', 'THIS SERVER IS A SLAVE, NO DDL/DML WILL BE RUN HERE!!! ONLY SELECTS ALLOWED!')
         else:
+            # Unbuffered, rows are streamed from the server while they are printed
+            cursor = cnx.cursor()
             if args.verbosity > 3:
                 log('debug', 'Got a cursor from the conection')
             cursor.execute(sql)
@@ -155,66 +254,21 @@ def execute(cnx, sql, showSlaveStatus=False):
             if cursor.with_rows:
                 if args.verbosity > 3:
                     log('debug', 'SELECT statement detected!!')
-                rows = cursor.fetchall()
-                # Calculate Max Length
-                if args.verbosity > 3:
-                    log('debug', 'Calculating Max Length for each column')
-                maxLength = {}
-                for column in cursor.column_names:
-                    maxLength[column] = len(column)
-                if args.verbosity > 2:
-                    log('log', 'MaxLengths')
-                    log('log', maxLength)
-                for row in rows:
-                    for column in cursor.column_names:
-                        if len(str(row[column])) > maxLength[column]:
-                            maxLength[column] = len(str(row[column]))
-                if args.verbosity > 2:
-                    log('log', 'MaxLengths')
-                    log('log', maxLength)
                 if not showSlaveStatus:
-                    # Print headers
-                    if args.verbosity > 3:
-                        log('debug', 'Printing Headers')
-                    for column in cursor.column_names:
-                        print(column.ljust(maxLength[column] + 2), end="")
-                    print("")
-                    # Print separator
-                    if args.verbosity > 3:
-                        log('debug', 'Printing Separator')
-                    for column in cursor.column_names:
-                        for j in range(maxLength[column] + 2):
-                            print("-", end="")
-                    print("")
-                    # Print rows
-                    for row in rows:
-                        for column in cursor.column_names:
-                            desc = cursor.description[cursor.column_names.index(
-                                column)]
-                            if FieldType.get_info(desc[1]) in ['BIGINT', 'DECIMAL', 'DOUBLE', 'FLOAT', 'INT', 'LONGLONG', 'NEWDECIMAL']:
-                                if args.verbosity > 3:
-                                    log('debug', 'Current field is ' +
-                                        FieldType.get_info(desc[1]))
-                                print(str(row[column]).rjust(
-                                    maxLength[column] + 2), end="")
-                            else:
-                                if args.verbosity > 3:
-                                    log('debug', 'Current field is ' +
-                                        FieldType.get_info(desc[1]))
-                                print(str(row[column]).ljust(
-                                    maxLength[column] + 2), end="")
-                        print("")
+                    render_rows(cursor, output_format=args.outputFormat, sample_rows=args.sampleRows)
                 else:  # showSlaveStatus
+                    rows = [dict(zip(cursor.column_names, row)) for row in cursor.fetchall()]
+                    width = max(len(column) for column in SLAVE_STATUS_COLUMNS)
                     for row in rows:
-                        for column in ['Slave_IO_State', 'Master_Host', 'Master_User', 'Master_Port', 'Master_Log_File', 'Read_Master_Log_Pos', 'Relay_Log_File', 'Relay_Log_Pos', 'Relay_Master_Log_File', 'Slave_IO_Running', 'Slave_SQL_Running', 'Last_Errno', 'Skip_Counter', 'Exec_Master_Log_Pos', 'Relay_Log_Space', 'Until_Condition', 'Until_Log_Pos', 'Seconds_Behind_Master', 'Last_IO_Errno', 'Last_SQL_Errno']:
-                            print(column.rjust(max(maxLength.values())) +
-                                  ": " + str(row[column]))
+                        for column in SLAVE_STATUS_COLUMNS:
+                            print(column.rjust(width) + ": " + str(row[column]))
             else:
                 if args.verbosity > 3:
                     log('debug', 'Not a select statement')
                 log('info',
                     f'Statement executed. {cursor.rowcount} rows affected!')
     except mysql.connector.Error as err:
+        success = False
         if args.verbosity > 3:
             log('debug', 'Catched exception while executing')
         log('critical', err.errno)
@@ -223,7 +277,12 @@ def execute(cnx, sql, showSlaveStatus=False):
     finally:
         if args.verbosity > 3:
             log('debug', 'Closing the cursor')
-        cursor.close()
+        try:
+            if cursor is not None:
+                cursor.close()
+        except mysql.connector.Error:
+            pass
+    return success
 
 
 def create_user(user_type=None, user_name=None, ip_address=None, user_pswd=None, environment=None):
@@ -287,12 +346,168 @@ def drop_user(user_type=None, user_name=None, ip_address=None):
     return command
 
 
+class HostOutput:
+    """
+    HostOutput:
+      stdout replacement that sends what each worker thread prints to that thread's buffer
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.stream.flush()
+
+    def capture(self, function, *args):
+        self.local.buffer = []
+        try:
+            return function(*args), ''.join(self.local.buffer)
+        finally:
+            self.local.buffer = None
+
+
+def is_replica(cnx, dbHost):
+    """
+    is_replica:
+      Cached primary/replica role of a database, checked again once --role-ttl expires.
+      None when the role can't be read, the policy then refuses writes and role filters
+    """
+    def probe():
+        try:
+            return probe_replica(cnx)
+        except mysql.connector.Error as err:
+            log('warning', f'Unable to check the replication role of {dbHost}: {err.msg}')
+            return None
+    return roles.is_replica(dbHost, probe)
+
+
+def crawl(target):
+    """
+    crawl:
+      Connects to one database (an inventory target), runs the script/command and disconnects.
+      Returns the host's status, duration and statement counts for the summary
+    """
+    dbHost = target['host'] if target['port'] == int(args.dbPort) else f"{target['host']}:{target['port']}"
+    result = {'host': dbHost, 'status': 'OK', 'statements': 0, 'errors': 0}
+    start = monotonic()
+    print("")
+    if target['address'] is None:
+        log('critical', f'Unable to resolve {target["host"]}')
+        cnx = None
+    else:
+        log('info', 'Connecting to ' + dbHost)
+        # By name unless asked otherwise, TLS hostname checks and host name grants need it
+        cnx = connect(p_user=args.dbUser, p_password=dbPswd,
+                      p_host=(target['address'] if args.connectByAddress else target['host']), p_port=target['port'], p_database=args.dbSchema, p_timeout=args.timeout)
+    if cnx:
+        timer = None
+        timed_out = []
+        if args.timeout:
+            # Cutting the socket makes the running statement fail right away
+            def cut():
+                timed_out.append(True)
+                try:
+                    cnx.shutdown()
+                except Exception:
+                    pass
+            timer = Timer(max(args.timeout - (monotonic() - start), 0), cut)
+            timer.daemon = True
+            timer.start()
+
+        def run(sql, showSlaveStatus=False):
+            result['statements'] += 1
+            if not execute(cnx=cnx, sql=sql, showSlaveStatus=showSlaveStatus, isReplica=is_replica(cnx, dbHost)):
+                result['errors'] += 1
+
+        if args.verbosity > 0:
+            log('notice', 'Checking SQL')
+    # The role policy is decided once per database
+        if not policy.allows_host(is_replica(cnx, dbHost)):
+            log('notice', f'Skipping {dbHost}, it is not a {args.role} or its role is unknown')
+            result['status'] = 'SKIPPED'
+    # If a SQL Script is provided
+        elif args.sqlScript:
+            if args.verbosity > 0:
+                log('notice', 'Executing as a script, 1 sentence at a time')
+            with open(args.sqlScript, "r") as script:
+                if args.verbosity > 3:
+                    log('debug', 'Splitting the script into statements')
+                for preparedSql in split_sql(script):
+                    if timed_out:
+                        break
+                    if args.verbosity > 0:
+                        log('log', 'Executing --> ' + preparedSql)
+                    run(preparedSql)
+                    print("")
+    # If a SQL statement/command is provided
+        elif args.sqlCommand:
+            preparedSql = args.sqlCommand
+            if args.verbosity > 3:
+                log('debug', 'Set preparedSql to ' + preparedSql)
+            run(preparedSql)
+    # If nothing is provided to run
+        elif args.showSlaveStatus:
+            log('info', 'Getting slave status for ' + dbHost)
+            run("SHOW SLAVE STATUS;", showSlaveStatus=True)
+        else:
+            log('warning', 'No script or command was provided, this will only test a connection')
+            preparedSql = "SELECT concat('Connected with user ', user(), ' to ', @@hostname) AS connection_test;"
+            run(preparedSql)
+        if timer:
+            timer.cancel()
+        if args.verbosity > 1:
+            log('log', 'Closing connection to the DB')
+        try:
+            disconnect(cnx)
+        except mysql.connector.Error:
+            pass
+        if timed_out:
+            log('error', f'Timeout of {args.timeout}s reached on {dbHost}, the connection was closed')
+            result['status'] = 'TIMEOUT'
+        elif result['errors']:
+            result['status'] = 'FAILED'
+    else:
+        result['status'] = 'UNREACHABLE'
+        if args.verbosity > 0:
+            log('log', f'Unable to connect to {dbHost}!')
+    result['duration'] = monotonic() - start
+    return result
+
+
+def print_summary(results):
+    """
+    print_summary:
+      Prints one line per database with its status and duration, then the totals
+    """
+    width = max([len('Database')] + [len(result['host']) for result in results])
+    print("")
+    print(f"{'Database'.ljust(width)}  {'Status'.ljust(11)}  {'Statements'.rjust(10)}  {'Errors'.rjust(6)}  {'Seconds'.rjust(8)}")
+    print("-" * (width + 45))
+    for result in results:
+        print(f"{result['host'].ljust(width)}  {result['status'].ljust(11)}  {str(result['statements']).rjust(10)}  {str(result['errors']).rjust(6)}  {result['duration']:8.2f}")
+    print("-" * (width + 45))
+    totals = {}
+    for result in results:
+        totals[result['status']] = totals.get(result['status'], 0) + 1
+    print(', '.join(f"{status}: {count}" for status, count in sorted(totals.items())) + f" (total {sum(result['duration'] for result in results):.2f}s)")
+
+
 ### Main Algorithm Start ###
 args = parser.parse_args()
 
 # Check Arguments
 if args.verbosity > 0:
     log('log', 'Checking arguments')
+policy = ExecutionPolicy(role=args.role)
+roles = RoleCache(ttl=args.roleTTL)
 
 if args.askForPassword:
     if args.verbosity > 1:
@@ -301,25 +516,17 @@ if args.askForPassword:
 
 if args.verbosity > 3:
     log('debug', 'Checking if the DB List is a file')
-# Build DB List
-dbList = []
-for i in range(len(args.dbList)):
-    if args.verbosity > 3:
-        log('debug', 'DB List has only 1 item')
-    if os.path.exists(args.dbList[i]):
+# Build DB List, files and host[:port] arguments are deduplicated and resolved up front
+inventory = Inventory(default_port=int(args.dbPort))
+for source in args.dbList:
+    if os.path.exists(source):
         if args.verbosity > 3:
             log('debug', 'DB List is a file and it exists')
-        fd = open(args.dbList[i], 'r')
-        if args.verbosity > 3:
-            log('debug', 'Populating dbList with file contents')
-        db = fd.readline()
-        while db:
-            dbList.append(db)
-            db = fd.readline()
+        inventory.load(source)
     else:
-        if args.verbosity > 3:
-            log('debug', 'Checking if the DB List is a file')
-        dbList.append(args.dbList[i])
+        inventory.add_text(source)
+inventory.resolve()
+dbList = list(inventory)
 
 if args.createUser:
     commands = create_user()
@@ -332,54 +539,22 @@ if args.dropUser:
     args.sqlCommand = drop_user()
 
 # Start Crawling
-for dbHost in dbList:
-    print("")
-    log('info', 'Connecting to ' + dbHost)
-    cnx = connect(p_user=args.dbUser, p_password=dbPswd,
-                  p_host=dbHost, p_port=args.dbPort, p_database=args.dbSchema)
-    if cnx:
-        if args.verbosity > 0:
-            log('notice', 'Checking SQL')
-    # If a SQL Script is provided
-        if args.sqlScript:
-            if args.verbosity > 0:
-                log('notice', 'Executing as a script, 1 sentence at a time')
-            script = open(args.sqlScript, "r")
-            if args.verbosity > 3:
-                log('debug', 'Reading first SQL line')
-            preparedSql = script.readline().replace("\n", " ")
-            while preparedSql:
-                while preparedSql.find(';') == -1:
-                    if args.verbosity > 3:
-                        log('debug', 'Reading SQL lines until ; is found')
-                    preparedSql = str(preparedSql) + \
-                        script.readline().replace("\n", " ")
-                    if args.verbosity > 3:
-                        log('debug', 'preparedSql is: ' + preparedSql)
-                if args.verbosity > 0:
-                    log('log', 'Executing --> ' + preparedSql)
-                execute(cnx=cnx, sql=preparedSql)
-                print("")
-                preparedSql = script.readline()
-    # If a SQL statement/command is provided
-        elif args.sqlCommand:
-            preparedSql = args.sqlCommand
-            if args.verbosity > 3:
-                log('debug', 'Set preparedSql to ' + preparedSql)
-            execute(cnx=cnx, sql=preparedSql)
-    # If nothing is provided to run
-        elif args.showSlaveStatus:
-            log('info', 'Getting slave status for ' + dbHost)
-            execute(cnx=cnx, sql="SHOW SLAVE STATUS;", showSlaveStatus=True)
-        else:
-            log('warning', 'No script or command was provided, this will only test a connection')
-            preparedSql = "SELECT concat('Connected with user ', user(), ' to ', @@hostname) AS connection_test;"
-            execute(cnx=cnx, sql=preparedSql)
-        if args.verbosity > 1:
-            log('log', 'Closing connection to the DB')
-        disconnect(cnx)
-    else:
-        if args.verbosity > 0:
-            log('log', f'Unable to connect to {dbHost}!')
+results = []
+if args.parallel > 1:
+    # Every host writes to its own buffer, printed whole and in dbList order
+    output = HostOutput(sys.stdout)
+    sys.stdout = output
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        futures = [executor.submit(output.capture, crawl, target) for target in dbList]
+        for future in futures:
+            result, text = future.result()
+            output.stream.write(text)
+            output.stream.flush()
+            results.append(result)
+    sys.stdout = output.stream
+else:
+    for target in dbList:
+        results.append(crawl(target))
+print_summary(results)
 if args.createUser:
     os.remove('tempScript.tmp')
@@ -18,6 +18,7 @@ __email__       = "jsanchez.consultant@gmail.com"
 __status__      = "Alpha"
 
 import mysqllib
+import mysqllib_inventory
 from argparse import ArgumentParser
 from datetime import datetime
 import json
@@ -122,15 +123,11 @@ def add_target(dialog_instance, db_dict):
             # Show file chooser
             code, path = d.fselect(filepath=os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),height=30,width=80)
             logger.log(DEBUG, f"Selected PATH --> {path}")
-            with open(path,'r') as fd:
-                line = fd.readline()
-                while line:
-                    if line.find(':') == -1:
-                        db_dict[line] = default_port
-                    else:
-                        data = line.split(':')
-                        db_dict[data[0]] = data[1]
-                    line = fd.readline()
+            inventory = mysqllib_inventory.Inventory(default_port=int(default_port))
+            inventory.load(path)
+            inventory.resolve()
+            for target in inventory:
+                db_dict[target['host']] = target['port']
     if code in ["esc", "cancel"]:
         code = ""
 
@@ -159,27 +156,23 @@ def remove_target(dialog_instance, databases):
         databases.pop(host)
 
 def read_targets_file(dialog_instance):
+    # Returns {host: port} like the databases dictionary, ports from host:port entries are kept
     d = dialog_instance
-    dbList = []
+    dbList = {}
     code, source = d.inputbox(
         text = "Please enter DB hostname or path to file containing a list of hostnames",
         width = 80
     )
     if code == d.OK:
+        inventory = mysqllib_inventory.Inventory(default_port=int(default_port))
         if os.path.exists(source):
             logger.log(DEBUG, 'DB List is a file and it exists')
-            fd = open(source,'r')
-            logger.log(DEBUG, 'Populating dbList with file contents')
-            db = fd.readline()
-            while db:
-                dbList.append(db.strip('\n'))
-                db = fd.readline()
+            inventory.load(source)
         else:
-            logger.log(DEBUG, 'Checking if the DB List is a file')
-            source_list = source.replace(' ',',').split(',')
-            for i in range(len(source_list)):
-                logger.log(DEBUG, 'DB List has only 1 item')
-                dbList.append(source_list[i])
+            logger.log(DEBUG, 'DB List is a list of hostnames')
+            inventory.add_text(source)
+        inventory.resolve()
+        dbList = {target['host']: target['port'] for target in inventory}
     return dbList
 
 def test_connection(dialog_instance, databases, creds):
@@ -199,16 +192,15 @@ def list_schemas(dialog_instance, databases):
     for host in databases:
         db = mysqllib.Database(host,databases[host])
         db.connect(username=creds['user'],password=creds['pswd'])
-        schemas = db.get_schemas()
-        db.disconnect()
         dialog_txt = "Schema name         - Character Set - Collation\n"
         dialog_txt += "=================== - ============= - ==================\n"
-        for item in schemas:
+        for item in db.iter_query('SELECT schema_name, default_character_set_name AS charset, default_collation_name as collation FROM information_schema.schemata'):
             dialog_txt += item['schema_name'].ljust(20)
             dialog_txt += " - "
             dialog_txt += item['charset'].ljust(13)
             dialog_txt += " - "
             dialog_txt += f"{item['collation']}\n"
+        db.disconnect()
         dialog_instance.msgbox(text=dialog_txt,height=30,width=70)
 
 ## Schema Menu
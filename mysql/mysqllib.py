@@ -19,12 +19,42 @@ __status__      = "Alpha"
 import mysql.connector
 from mysql.connector import errorcode
 from mysql.connector import FieldType
+from mysql.connector.errors import InterfaceError
+from mysql.connector.errors import OperationalError
+from mysql.connector.errors import PoolError
 from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from contextlib import contextmanager
+from itertools import chain
+from datetime import date
 from datetime import datetime
 from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from hashlib import sha1
+from shutil import copyfileobj
+from tempfile import NamedTemporaryFile
+from tempfile import TemporaryFile
+from threading import Condition
+from threading import Lock
+from time import monotonic
+from time import perf_counter_ns
 from time import sleep
+from time import time
 import getpass
+import io
+import json
 import logging
+import os
+import re
+import sys
 from logging import DEBUG
 from logging import CRITICAL
 from logging import ERROR
@@ -39,17 +69,1032 @@ logging.basicConfig(
 )
 logger = logging.getLogger()
     
+# Statement classification
+# Leading token of a statement, once code_start() has skipped whitespace and comments.
+# Version comments (/*!40101 SET ... */) count as code, like the server does
+LEADING_SPACE = re.compile(r"\s*")
+LEADING_TOKEN = re.compile(r"(?:/\*!\d*)?[(\s]*([A-Za-z]+)")
+WRITE_STATEMENTS = {'CREATE', 'DROP', 'ALTER', 'GRANT', 'REVOKE', 'INSERT', 'DELETE', 'UPDATE', 'IMPORT', 'RENAME', 'REPLACE', 'TRUNCATE', 'LOAD', 'CALL'}
+# WITH ... UPDATE/DELETE and global SET are only writes depending on what follows the leading token
+DML_VERB = re.compile(r"\b(INSERT|UPDATE|DELETE|REPLACE)\b", re.I)
+GLOBAL_SET = re.compile(r"\bGLOBAL\b|\bPERSIST(?:_ONLY)?\b|@@(?:GLOBAL|PERSIST(?:_ONLY)?)\.", re.I)
+
+def code_start(sql):
+    # Position of the first character that is neither whitespace nor part of a comment.
+    # A plain scanner rather than a regex so comment-only text can't backtrack
+    position = 0
+    length = len(sql)
+    while position < length:
+        position = LEADING_SPACE.match(sql, position).end()
+        if sql.startswith('--', position) or sql.startswith('#', position):
+            end = sql.find('\n', position)
+        elif sql.startswith('/*', position) and not sql.startswith('/*!', position):
+            end = sql.find('*/', position + 2)
+            end = end + 1 if end != -1 else end
+        else:
+            break
+        if end == -1:
+            return length
+        position = end + 1
+    return position
+
+def statement_type(sql):
+    # Only the beginning of the statement is inspected, never the whole text
+    match = LEADING_TOKEN.match(sql, code_start(sql))
+    if match:
+        return match.group(1).upper()
+    return ''
+
+def is_write(sql):
+    # Stored procedures may write anything, so CALL counts as a write
+    kind = statement_type(sql)
+    if kind in WRITE_STATEMENTS:
+        return True
+    if kind == 'WITH':
+        return DML_VERB.search(sql) is not None
+    if kind == 'SET':
+        return GLOBAL_SET.search(sql) is not None
+    return False
+
+# Script splitting
+QUOTE_ENDS = {
+    "'": re.compile(r"\\.|'"),
+    '"': re.compile(r'\\.|"'),
+    '`': re.compile(r'`')
+}
+
+@lru_cache(maxsize=16)
+def _split_tokens(delimiter):
+    return re.compile(r"['\"`]|/\*|--(?=\s|$)|#|" + re.escape(delimiter))
+
+def split_sql(stream, delimiters=False):
+    # Yields the statements of a SQL script read line by line from stream, honouring
+    # quotes, comments and DELIMITER commands. Memory is bounded by the longest statement.
+    # With delimiters=True it yields (statement, delimiter) tuples
+    delimiter = ';'
+    tokens = _split_tokens(delimiter)
+    parts = []
+    has_content = False
+    quote = None
+    in_comment = False
+    for line in stream:
+        if not has_content and quote is None and not in_comment:
+            stripped = line.strip()
+            if stripped[:10].upper() == 'DELIMITER ' or stripped.upper() == 'DELIMITER':
+                words = stripped.split()
+                if len(words) > 1:
+                    delimiter = words[1]
+                    tokens = _split_tokens(delimiter)
+                parts = []
+                continue
+        position = 0
+        length = len(line)
+        while position < length:
+            if in_comment:
+                end = line.find('*/', position)
+                if end == -1:
+                    parts.append(line[position:])
+                    break
+                parts.append(line[position:end + 2])
+                position = end + 2
+                in_comment = False
+            elif quote is not None:
+                match = QUOTE_ENDS[quote].search(line, position)
+                while match and match.group() != quote:
+                    match = QUOTE_ENDS[quote].search(line, match.end())
+                if match is None:
+                    parts.append(line[position:])
+                    break
+                parts.append(line[position:match.end()])
+                position = match.end()
+                quote = None
+            else:
+                match = tokens.search(line, position)
+                if match is None:
+                    chunk = line[position:]
+                    parts.append(chunk)
+                    has_content = has_content or not chunk.isspace()
+                    break
+                token = match.group()
+                if token == delimiter:
+                    parts.append(line[position:match.start()])
+                    statement = ''.join(parts).strip()
+                    if statement_type(statement):
+                        yield (statement, delimiter) if delimiters else statement
+                    parts = []
+                    has_content = False
+                    position = match.end()
+                    continue
+                # Comments alone don't start a statement, a DELIMITER line may still follow
+                if token in QUOTE_ENDS or (match.start() > position and not line[position:match.start()].isspace()):
+                    has_content = True
+                parts.append(line[position:match.end()])
+                position = match.end()
+                if token in QUOTE_ENDS:
+                    quote = token
+                elif token == '/*':
+                    in_comment = True
+                else:
+                    # -- and # comments run until the end of the line
+                    parts.append(line[position:])
+                    break
+    statement = ''.join(parts).strip()
+    if statement_type(statement):
+        yield (statement, delimiter) if delimiters else statement
+
+# Query metrics
+# Latency histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FINGERPRINT_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b|%s")
+FINGERPRINT_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+FINGERPRINT_MAX_LENGTH = 2048
+
+@lru_cache(maxsize=4096)
+def _fingerprint(sql):
+    sql = FINGERPRINT_LITERALS.sub('?', sql)
+    sql = FINGERPRINT_LISTS.sub('(?+)', sql)
+    return ' '.join(sql.split()).rstrip(';').lower()
+
+def fingerprint(sql):
+    # Normalized SQL: literals replaced by ?, value lists folded, whitespace collapsed.
+    # Only the head of very long statements (bulk INSERTs) is looked at
+    return _fingerprint(sql[:FINGERPRINT_MAX_LENGTH])
+
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def observe(self, seconds, rows=0):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.rows += rows
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and cumulative + bucket_count >= target:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (target - cumulative) / bucket_count, self.max)
+            cumulative += bucket_count
+        return self.max
+
+class QueryMetrics:
+    def __init__(self, hostname=None):
+        self.hostname = hostname
+        self.lock = Lock()
+        self.histograms = {}
+
+    def observe(self, sql, elapsed_ns, rows=0):
+        key = (statement_type(sql), fingerprint(sql))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(elapsed_ns / 1e9, rows)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def as_dict(self):
+        with self.lock:
+            items = list(self.histograms.items())
+        statements = []
+        for (action, sql_fingerprint), histogram in items:
+            statements.append({
+                "action": action,
+                "fingerprint": sql_fingerprint,
+                "count": histogram.count,
+                "rows": histogram.rows,
+                "total_s": histogram.sum,
+                "max_s": histogram.max,
+                "p50_s": histogram.quantile(0.50),
+                "p95_s": histogram.quantile(0.95),
+                "p99_s": histogram.quantile(0.99)
+            })
+        # Most expensive statements first
+        statements.sort(key=lambda item: item["total_s"], reverse=True)
+        return {
+            "hostname": self.hostname,
+            "statements": statements
+        }
+
+    def to_prometheus(self, prefix="mysqllib"):
+        def label(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        with self.lock:
+            items = sorted(self.histograms.items())
+        lines = [
+            f"# HELP {prefix}_statement_duration_seconds Statement latency",
+            f"# TYPE {prefix}_statement_duration_seconds histogram"
+        ]
+        for (action, sql_fingerprint), histogram in items:
+            labels = f'host="{label(self.hostname)}",action="{label(action)}",fingerprint="{label(sql_fingerprint)}"'
+            cumulative = 0
+            for bucket, bucket_count in zip(histogram.buckets, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f'{prefix}_statement_duration_seconds_bucket{{{labels},le="{bucket}"}} {cumulative}')
+            lines.append(f'{prefix}_statement_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f'{prefix}_statement_duration_seconds_sum{{{labels}}} {histogram.sum}')
+            lines.append(f'{prefix}_statement_duration_seconds_count{{{labels}}} {histogram.count}')
+        lines.append(f"# HELP {prefix}_statement_rows_total Rows returned")
+        lines.append(f"# TYPE {prefix}_statement_rows_total counter")
+        for (action, sql_fingerprint), histogram in items:
+            labels = f'host="{label(self.hostname)}",action="{label(action)}",fingerprint="{label(sql_fingerprint)}"'
+            lines.append(f'{prefix}_statement_rows_total{{{labels}}} {histogram.rows}')
+        return "\n".join(lines) + "\n"
+
+# Optional dependency for columnar results
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Compact array typecodes for numeric column types (see cursor.description)
+COLUMN_TYPECODES = {
+    FieldType.TINY: 'q',
+    FieldType.SHORT: 'q',
+    FieldType.INT24: 'q',
+    FieldType.LONG: 'q',
+    FieldType.LONGLONG: 'q',
+    FieldType.YEAR: 'q',
+    FieldType.FLOAT: 'd',
+    FieldType.DOUBLE: 'd'
+}
+
+def format_rows(rows, description, result_format='dict', numpy_arrays=False):
+    columns = [desc[0] for desc in description]
+    if result_format == 'dict':
+        return {'rows': [dict(zip(columns, row)) for row in rows]}
+    elif result_format == 'tuple':
+        return {'columns': columns, 'rows': rows}
+    elif result_format == 'columnar':
+        data = {}
+        values_by_column = list(zip(*rows)) if rows else [() for column in columns]
+        for desc, values in zip(description, values_by_column):
+            typecode = COLUMN_TYPECODES.get(desc[1])
+            data[desc[0]] = list(values)
+            if typecode and None not in values:
+                # Out of range values (unsigned BIGINT) keep the plain list
+                try:
+                    if numpy_arrays and numpy is not None:
+                        data[desc[0]] = numpy.array(values, dtype=('int64' if typecode == 'q' else 'float64'))
+                    else:
+                        data[desc[0]] = array(typecode, values)
+                except (TypeError, ValueError, OverflowError):
+                    pass
+        return {'columns': columns, 'data': data}
+    else:
+        raise ValueError(f"Unknown result format: {result_format}")
+
+def tsv_value(value):
+    # Value rendered for LOAD DATA INFILE with the default FIELDS/LINES options
+    if value is None:
+        return b'\\N'
+    if isinstance(value, (bytes, bytearray)):
+        raw = bytes(value)
+    elif isinstance(value, bool):
+        raw = b'1' if value else b'0'
+    else:
+        raw = str(value).encode('utf-8')
+    return raw.replace(b'\\', b'\\\\').replace(b'\t', b'\\t').replace(b'\n', b'\\n').replace(b'\0', b'\\0')
+
+def range_condition(key, lower=None, upper=None):
+    # WHERE clause and params for the key range (lower, upper], row constructors handle composite keys
+    conditions = []
+    params = []
+    key_tuple = f"({','.join(key)})"
+    key_placeholders = f"({','.join(['%s'] * len(key))})"
+    if lower is not None:
+        conditions.append(f"{key_tuple} > {key_placeholders}")
+        params += list(lower)
+    if upper is not None:
+        conditions.append(f"{key_tuple} <= {key_placeholders}")
+        params += list(upper)
+    return ' AND '.join(conditions) or '1=1', params
+
+# Column types whose values are written as hex literals in fix scripts
+BINARY_TYPES = ('binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'bit', 'geometry', 'point', 'linestring', 'polygon')
+
+def sql_literal(value, data_type=None):
+    # Value rendered as a MySQL literal for generated fix scripts, data_type is the
+    # information_schema.columns data_type of the column when known
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float, Decimal)):
+        if data_type == 'bit':
+            return f"b'{int(value):b}'"
+        return str(value)
+    if data_type in BINARY_TYPES or isinstance(value, (bytes, bytearray)):
+        raw = value if isinstance(value, (bytes, bytearray)) else str(value).encode('utf-8')
+        return f"X'{bytes(raw).hex()}'" if raw else "''"
+    if isinstance(value, datetime):
+        return f"'{value.isoformat(sep=' ')}'"
+    if isinstance(value, date):
+        return f"'{value.isoformat()}'"
+    if isinstance(value, timedelta):
+        # TIME columns come back as timedelta, which can be negative or exceed 24 hours
+        microseconds = value // timedelta(microseconds=1)
+        sign = '-' if microseconds < 0 else ''
+        seconds, microseconds = divmod(abs(microseconds), 1000000)
+        fraction = f".{microseconds:06d}" if microseconds else ''
+        return f"'{sign}{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}{fraction}'"
+    if isinstance(value, (set, frozenset)):
+        # SET columns
+        value = ','.join(sorted(value))
+    text = str(value)
+    return "'" + text.replace('\\', '\\\\').replace("'", "\\'").replace('\n', '\\n').replace('\r', '\\r').replace('\0', '\\0').replace('\x1a', '\\Z') + "'"
+
+# Data comparison helpers
+# Column types compared by their bytes when ordering keys for merge_join
+STRING_TYPES = ('char', 'varchar', 'tinytext', 'text', 'mediumtext', 'longtext', 'enum', 'set')
+
+def row_expression(columns):
+    # One string per row for hashing, ISNULL() flags tell NULLs apart from empty values
+    return f"CONCAT_WS('#', {','.join(columns)}, CONCAT({','.join(f'ISNULL({column})' for column in columns)}))"
+
+def merge_join(local_hashes, remote_hashes):
+    # Merges two (key, row hash) streams sorted by key, yields (event, key) for every key
+    # missing on one side or whose hash differs. O(n) and only one row per side in memory
+    local = next(local_hashes, None)
+    remote = next(remote_hashes, None)
+    while local is not None or remote is not None:
+        if remote is None or (local is not None and local[0] < remote[0]):
+            yield 'missing_remote', local[0]
+            local = next(local_hashes, None)
+        elif local is None or remote[0] < local[0]:
+            yield 'missing_local', remote[0]
+            remote = next(remote_hashes, None)
+        else:
+            if local[1] != remote[1]:
+                yield 'changed', local[0]
+            local = next(local_hashes, None)
+            remote = next(remote_hashes, None)
+
+def new_compare_summary():
+    return {
+        "chunks": 0,
+        "chunks_different": 0,
+        "rows_fetched": 0,
+        "missing_local": 0,
+        "missing_remote": 0,
+        "conflicts": 0,
+        "errors": 0,
+        "failed_chunks": []
+    }
+
+def add_chunk_to_summary(summary, diff):
+    summary["chunks"] += 1
+    if diff is None or "error" in diff:
+        # Never report a chunk as equal when it could not be compared
+        summary["errors"] += 1
+        if diff is not None:
+            logger.log(ERROR, f'Chunk {diff["lower"]} - {diff["upper"]} could not be compared: {diff["error"]}')
+            summary["failed_chunks"].append(diff)
+        return
+    if diff["different"]:
+        summary["chunks_different"] += 1
+        summary["rows_fetched"] += diff["rows_fetched"]
+        summary["missing_local"] += len(diff["missing_local"])
+        summary["missing_remote"] += len(diff["missing_remote"])
+        summary["conflicts"] += len(diff["conflicts"])
+
+def add_boundary_error(summary, fqn, last_upper, err):
+    # Without the next boundary the rest of the table can't be split, so it is left uncompared
+    logger.log(WARNING, f'Catched exception while splitting {fqn} in chunks')
+    logger.log(CRITICAL, err)
+    logger.log(ERROR, f'Rows after {last_upper} were not compared' if last_upper is not None else 'No rows were compared')
+    summary["errors"] += 1
+
+def log_compare_summary(summary):
+    logger.log(INFO,f'{summary["chunks"]} chunks checked, {summary["chunks_different"]} different, {summary["rows_fetched"]} rows fetched')
+    if summary["errors"]:
+        logger.log(ERROR,f'{summary["errors"]} chunks could not be compared')
+
+def print_chunk_diff(diff, local_host, remote_host):
+    for local_row, remote_row in diff["conflicts"]:
+        print(f'Conflict Local: {local_row}')
+        print(f'Conflict Remote: {remote_row}')
+    for local_row in diff["missing_remote"]:
+        print(f'local: {local_row}')
+        print(f'Missing at {remote_host}')
+    for remote_row in diff["missing_local"]:
+        print(f'Missing at {local_host}')
+        print(f'remote: {remote_row}')
+
+def write_chunk_fixes(diff, remote_writer, local_writer=None):
+    # Local rows win: the remote side gets the missing and conflicting rows and loses its extra
+    # rows, unless a local_writer is given, then the extra rows are copied to the local side instead
+    for row in diff["missing_remote"]:
+        remote_writer.insert(row)
+    for local_row, remote_row in diff["conflicts"]:
+        remote_writer.replace(local_row)
+    for row in diff["missing_local"]:
+        if local_writer is None:
+            remote_writer.delete(row)
+        else:
+            local_writer.insert(row)
+
+def table_spec(table):
+    # Everything a worker process needs to open its own connection to the table's server
+    database = table.database
+    return {
+        "hostname": database.hostname,
+        "port": database.port,
+        "username": database.username,
+        "password": database.password,
+        "auth_plugin": database.auth_plugin,
+        "schema": table.schema.name,
+        "table": table.name
+    }
+
+# Per process state of the compare_data_parallel workers
+compare_worker_tables = {}
+
+def init_compare_worker(local_spec, remote_spec):
+    # Two connections per side: the row hash stream and the lookups of differing rows.
+    # A failure is kept and reported by every chunk, an initializer that raises breaks the pool
+    for side, spec in (('local', local_spec), ('remote', remote_spec)):
+        try:
+            database = Database(hostname=spec["hostname"], port=spec["port"], log_level=logger.level)
+            database.connect(username=spec["username"], password=spec["password"], auth_plugin=spec["auth_plugin"], nolog=True, pool_size=2)
+            if not database.is_connected():
+                raise InterfaceError(msg='Unable to connect')
+            compare_worker_tables[side] = Table(schema=Schema(database, spec["schema"]), name=spec["table"])
+        except Exception as err:
+            compare_worker_tables['error'] = f'{spec["hostname"]}:{spec["port"]}: {err!r}'
+            return
+
+def compare_chunk_worker(lower, upper, key, columns, algorithm):
+    # Errors come back as a chunk entry with the range and the host instead of as an exception
+    error = compare_worker_tables.get('error')
+    if error is None:
+        local, remote = compare_worker_tables['local'], compare_worker_tables['remote']
+        try:
+            diff = local.compare_chunk(remote, lower, upper, key, columns, algorithm)
+            if diff is not None:
+                return diff
+            error = f'{local.database.hostname} / {remote.database.hostname}: checksum or row fetch failed, see the worker log'
+        except Exception as err:
+            error = f'{local.database.hostname} / {remote.database.hostname}: {err!r}'
+    return {
+        "lower": lower,
+        "upper": upper,
+        "error": error
+    }
+
+# Metadata
+def table_metadata(row):
+    # Table entry as used by Schema.tables and Schema.compare
+    return {
+        'schema_name': row['schema_name'],
+        'table_name': row['table_name'],
+        'full_name': f"{row['schema_name']}.{row['table_name']}",
+        'table_type': row['table_type'],
+        'table_rows': row['table_rows'],
+        'avg_row_length': row['avg_row_length'],
+        'max_data_length': row['max_data_length'],
+        'columns': {},
+        'indexes': {},
+        'constraints': {}
+    }
+
+def column_metadata(row):
+    return {
+        'ordinal_position': row['ordinal_position'],
+        'column_default': row['column_default'],
+        'is_nullable': row['is_nullable'],
+        'data_type': row['data_type'],
+        'column_type': row['column_type'],
+        'charset': row['character_set_name'],
+        'collation': row['collation_name'],
+        'extra': row.get('extra')
+    }
+
+# Metadata cache class
+class MetadataCache:
+    # Schema metadata snapshots keyed by (host, port, schema). A snapshot is reused while the
+    # checksum of its signature (information_schema.tables plus column and index checksums)
+    # is unchanged, otherwise only the tables whose signature moved are fetched again.
+    # max_age (seconds, None for never) forces a full reload
+    def __init__(self, path=None, max_age=86400):
+        self.path = path
+        self.max_age = max_age
+        self.lock = Lock()
+        self.snapshots = {}
+        self.hits = 0
+        self.refreshes = 0
+        self.loads = 0
+        if path and os.path.exists(path):
+            self.load()
+
+    def key(self, database, schema_name):
+        return f"{database.hostname}:{database.port}/{schema_name}"
+
+    def get_signature(self, database, schema_name):
+        # {table_name: signature}. CREATE_TIME only moves on table rebuilds and UPDATE_TIME is cached
+        # (information_schema_stats_expiry), so INPLACE/INSTANT ALTERs are caught by per-table
+        # checksums of the column and index definitions, aggregated by the server
+        signature = {}
+        for row in database.iter_query("SELECT table_name AS table_name, table_type AS table_type, engine AS engine, table_collation AS table_collation, create_time AS create_time, update_time AS update_time FROM information_schema.tables WHERE table_schema = %s ORDER BY 1", params=(schema_name,), raise_errors=True):
+            signature[row['table_name']] = f"{row['table_type']}|{row['engine']}|{row['table_collation']}|{row['create_time']}|{row['update_time']}"
+        for row in database.iter_query("SELECT table_name AS table_name, COUNT(*) AS columns, SUM(CRC32(CONCAT_WS('|', column_name, ordinal_position, column_type, is_nullable, column_default, character_set_name, collation_name, extra))) AS checksum FROM information_schema.columns WHERE table_schema = %s GROUP BY table_name", params=(schema_name,), raise_errors=True):
+            if row['table_name'] in signature:
+                signature[row['table_name']] += f"|c{row['columns']}:{row['checksum']}"
+        for row in database.iter_query("SELECT table_name AS table_name, COUNT(*) AS columns, SUM(CRC32(CONCAT_WS('|', index_name, seq_in_index, column_name, non_unique, index_type, sub_part))) AS checksum FROM information_schema.statistics WHERE table_schema = %s GROUP BY table_name", params=(schema_name,), raise_errors=True):
+            if row['table_name'] in signature:
+                signature[row['table_name']] += f"|i{row['columns']}:{row['checksum']}"
+        return signature
+
+    def get_tables(self, database, schema_name):
+        # Catalog errors are raised before anything is stored, a failed load is never cached
+        key = self.key(database, schema_name)
+        signature = self.get_signature(database, schema_name)
+        checksum = sha1(json.dumps(signature, sort_keys=True).encode()).hexdigest()
+        with self.lock:
+            snapshot = self.snapshots.get(key)
+        if snapshot and (self.max_age is None or time() - snapshot['loaded_at'] < self.max_age):
+            if snapshot['checksum'] == checksum:
+                self.hits += 1
+                return snapshot['tables']
+            changed = [table_name for table_name in signature if snapshot['signature'].get(table_name) != signature[table_name]]
+            logger.debug(f"{key}: {len(changed)} changed tables, {len(set(snapshot['signature']) - set(signature))} dropped")
+            tables = {table_name: table for table_name, table in snapshot['tables'].items() if table_name in signature}
+            if changed:
+                tables.update(database.load_metadata([schema_name], changed)[schema_name])
+            loaded_at = snapshot['loaded_at']
+            self.refreshes += 1
+        else:
+            tables = database.load_metadata([schema_name])[schema_name]
+            loaded_at = time()
+            self.loads += 1
+        tables = {table_name: tables[table_name] for table_name in sorted(tables)}
+        with self.lock:
+            self.snapshots[key] = {
+                'signature': signature,
+                'checksum': checksum,
+                'loaded_at': loaded_at,
+                'tables': tables
+            }
+        return tables
+
+    def invalidate(self, database=None, schema_name=None):
+        with self.lock:
+            if database is None:
+                self.snapshots = {}
+            elif schema_name is None:
+                prefix = f"{database.hostname}:{database.port}/"
+                self.snapshots = {key: snapshot for key, snapshot in self.snapshots.items() if not key.startswith(prefix)}
+            else:
+                self.snapshots.pop(self.key(database, schema_name), None)
+
+    def load(self, path=None):
+        with open(path or self.path) as cache_file:
+            snapshots = json.load(cache_file)
+        with self.lock:
+            self.snapshots.update(snapshots)
+
+    def save(self, path=None):
+        # Written to a temporary file first so concurrent readers never see a partial snapshot
+        path = path or self.path
+        with self.lock:
+            data = json.dumps(self.snapshots, default=str)
+        with open(f"{path}.tmp", 'w') as cache_file:
+            cache_file.write(data)
+        os.replace(f"{path}.tmp", path)
+
+    def statistics(self):
+        return {
+            "snapshots": len(self.snapshots),
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "loads": self.loads
+        }
+
+# Fix script writer class
+class FixScriptWriter:
+    # Streams data repair statements for one table. Rows are grouped into multi-row
+    # INSERT/REPLACE statements and key-list DELETEs of at most batch_rows rows and batch_bytes
+    # bytes, written to stream (any object with write(): file, socket.makefile(), sys.stdout) as
+    # soon as a batch is full. With apply=True the same batches are executed on the table's
+    # server through executemany, committing every batches_per_transaction batches
+    def __init__(self, table, stream=None, apply=False, columns=None, key=None, batch_rows=500, batch_bytes=1048576, batches_per_transaction=10):
+        self.table = table
+        self.stream = stream
+        self.apply = apply
+        column_types = {column: attributes['data_type'] for column, attributes in table.get_columns().items()}
+        self.columns = list(columns or column_types.keys())
+        self.column_types = [column_types.get(column) for column in self.columns]
+        self.key = list(key or table.get_primary_key())
+        self.key_types = [column_types.get(column) for column in self.key]
+        self.batch_rows = batch_rows
+        self.batch_bytes = batch_bytes
+        self.batches_per_transaction = batches_per_transaction
+        self.buffers = {'DELETE': [], 'INSERT': [], 'REPLACE': []}
+        self.sizes = {'DELETE': 0, 'INSERT': 0, 'REPLACE': 0}
+        self.pooled = None
+        self.cursor = None
+        self.summary = {
+            "inserted": 0,
+            "replaced": 0,
+            "deleted": 0,
+            "statements": 0,
+            "batches": 0,
+            "errors": 0
+        }
+        if self.stream is not None:
+            self.stream.write(f"-- Run on {table.database.hostname}:{table.database.port}\n")
+
+    def insert(self, row):
+        self.add('INSERT', row, self.columns, self.column_types)
+
+    def replace(self, row):
+        self.add('REPLACE', row, self.columns, self.column_types)
+
+    def delete(self, row):
+        self.add('DELETE', row, self.key, self.key_types)
+
+    def add(self, statement, row, columns, types):
+        values = tuple(row[column] for column in columns)
+        literal = f"({','.join(sql_literal(value, data_type) for value, data_type in zip(values, types))})"
+        size = len(literal.encode()) + 1
+        if self.buffers[statement] and (len(self.buffers[statement]) >= self.batch_rows or self.sizes[statement] + size > self.batch_bytes):
+            self.flush(statement)
+        self.buffers[statement].append((values, literal))
+        self.sizes[statement] += size
+
+    def flush(self, statement=None):
+        for statement in [statement] if statement else ['DELETE', 'REPLACE', 'INSERT']:
+            batch = self.buffers[statement]
+            if not batch:
+                continue
+            self.buffers[statement] = []
+            self.sizes[statement] = 0
+            if statement == 'DELETE':
+                sql = f"DELETE FROM {self.table.fqn} WHERE ({','.join(self.key)}) IN ({','.join(literal for values, literal in batch)});"
+            else:
+                sql = f"{statement} INTO {self.table.fqn} ({','.join(self.columns)}) VALUES {','.join(literal for values, literal in batch)};"
+            if self.stream is not None:
+                self.stream.write(sql + "\n")
+            if self.apply:
+                self.execute(statement, [values for values, literal in batch])
+            self.summary["statements"] += 1
+            self.summary[{'DELETE': 'deleted', 'INSERT': 'inserted', 'REPLACE': 'replaced'}[statement]] += len(batch)
+
+    def execute(self, statement, rows):
+        # Parameterized, so the connector does the escaping. Every batch is sent as one
+        # multi-row statement, executemany only rewrites INSERT that way and not REPLACE
+        try:
+            if self.pooled is None:
+                self.pooled = self.table.database.pool.acquire()
+                self.cursor = self.pooled.cnx.cursor()
+            self.pooled.begin()
+            timer_start = perf_counter_ns()
+            if statement == 'DELETE':
+                row_placeholders = f"({','.join(['%s'] * len(self.key))})"
+                sql = f"DELETE FROM {self.table.fqn} WHERE ({','.join(self.key)}) IN ({','.join([row_placeholders] * len(rows))})"
+                self.cursor.execute(sql, [value for row in rows for value in row])
+            else:
+                row_placeholders = f"({','.join(['%s'] * len(self.columns))})"
+                sql = f"{statement} INTO {self.table.fqn} ({','.join(self.columns)}) VALUES {','.join([row_placeholders] * len(rows))}"
+                self.cursor.execute(sql, [value for row in rows for value in row])
+            self.table.database.metrics.observe(sql, perf_counter_ns() - timer_start)
+            self.summary["batches"] += 1
+            if self.summary["batches"] % self.batches_per_transaction == 0:
+                self.pooled.cnx.commit()
+        except mysql.connector.Error as err:
+            logger.log(WARNING, f'Catched exception while fixing {self.table.fqn}')
+            logger.log(CRITICAL, err.errno)
+            logger.log(CRITICAL, err.sqlstate)
+            logger.log(CRITICAL, err.msg)
+            self.summary["errors"] += 1
+
+    def close(self):
+        self.flush()
+        if self.stream is not None:
+            self.stream.write("commit;\n")
+        if self.pooled is not None:
+            try:
+                self.pooled.cnx.commit()
+            except mysql.connector.Error as err:
+                logger.log(CRITICAL, err)
+                self.summary["errors"] += 1
+            self.cursor.close()
+            self.table.database.pool.release(self.pooled)
+            self.pooled = None
+        return self.summary
+
+# Replica role cache class
+class RoleCache:
+    # Remembers whether a server is a replica for ttl seconds, so statement loops don't pay
+    # a SHOW SLAVE STATUS round trip per statement. Keys are whatever identifies the server
+    # or connection for the caller (a Database, a host name, a connection id)
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.roles = {}
+
+    def is_replica(self, key, probe, ttl=None):
+        # probe() runs the actual check, only when the cached answer is missing or older than
+        # ttl (this call only, defaults to the cache's). None means the role couldn't be read,
+        # it is cached as well so a server denying the check isn't probed on every statement
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            cached = self.roles.get(key)
+        if cached is not None and (ttl is None or monotonic() - cached[1] < ttl):
+            return cached[0]
+        replica = probe()
+        with self.lock:
+            self.roles[key] = (replica, monotonic())
+        return replica
+
+    def invalidate(self, key=None):
+        with self.lock:
+            if key is None:
+                self.roles = {}
+            else:
+                self.roles.pop(key, None)
+
+def probe_replica(cnx):
+    # True when the server has replication configured, for plain connector connections
+    cursor = cnx.cursor(buffered=True)
+    try:
+        cursor.execute("SHOW SLAVE STATUS")
+        return len(cursor.fetchall()) > 0
+    finally:
+        cursor.close()
+
+# Execution policy class
+class ExecutionPolicy:
+    # Which hosts a run targets and what may run on them, decided once per host from its role.
+    # role='primary' only runs on primaries, 'replica' only on replicas, 'any' runs everywhere
+    # but keeps writes (see is_write) off replicas unless allow_replica_writes is set.
+    # is_replica=None (role unknown) fails safe: it is neither a primary nor a replica and
+    # gets no writes
+    ROLES = ('primary', 'replica', 'any')
+
+    def __init__(self, role='any', allow_replica_writes=False):
+        if role not in self.ROLES:
+            raise ValueError(f"role must be one of {self.ROLES}")
+        self.role = role
+        self.allow_replica_writes = allow_replica_writes
+
+    def allows_host(self, is_replica):
+        if self.role == 'primary':
+            return is_replica is False
+        if self.role == 'replica':
+            return is_replica is True
+        return True
+
+    def allows(self, sql, is_replica):
+        if is_replica is not False and not self.allow_replica_writes:
+            return not is_write(sql)
+        return True
+
+# Pooled connection class
+class PooledConnection:
+    def __init__(self, cnx, statement_cache_size=64):
+        self.cnx = cnx
+        self.created = monotonic()
+        self.last_used = self.created
+        self.statements = StatementCache(capacity=statement_cache_size)
+        # Set by execute_on when a write ran without commit
+        self.uncommitted_writes = False
+
+    def begin(self):
+        # Pooled connections run in autocommit so reads leave nothing to roll back,
+        # writes that have to be grouped or rolled back open a transaction first
+        if not self.cnx.in_transaction:
+            self.cnx.start_transaction()
+
+# Prepared statement cache class (LRU, one per connection)
+class StatementCache:
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self.cursors = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, cnx, sql):
+        # Returns the prepared cursor and the cached SQL string. The connector only skips
+        # the PREPARE round trip when it gets the very same string object it prepared
+        entry = self.cursors.get(sql)
+        if entry is not None:
+            self.cursors.move_to_end(sql)
+            self.hits += 1
+            return entry, True
+        self.misses += 1
+        entry = (cnx.cursor(prepared=True), sql)
+        self.cursors[sql] = entry
+        if len(self.cursors) > self.capacity:
+            evicted_sql, evicted = self.cursors.popitem(last=False)
+            self._close(evicted[0])
+            self.evictions += 1
+        return entry, False
+
+    def discard(self, sql):
+        entry = self.cursors.pop(sql, None)
+        if entry is not None:
+            self._close(entry[0])
+
+    def _close(self, cursor):
+        # Closing the cursor deallocates the statement on the server
+        try:
+            cursor.close()
+        except mysql.connector.Error as err:
+            logger.debug(f"Error while closing prepared statement: {err}")
+
+# Connection pool class
+class ConnectionPool:
+    def __init__(self, size=5, stale_after=60, timeout=30, statement_cache_size=64, **connect_args):
+        self.size = size
+        self.stale_after = stale_after
+        self.timeout = timeout
+        self.statement_cache_size = statement_cache_size
+        self.connect_args = connect_args
+        self.idle = deque()
+        self.opened = 0
+        self.in_use = 0
+        self.closed = False
+        self.lock = Condition()
+        self.counters = {
+            "created": 0,
+            "reused": 0,
+            "validated": 0,
+            "replaced": 0,
+            "discarded": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "statement_hits": 0,
+            "statement_misses": 0
+        }
+
+    def _open(self):
+        pooled = PooledConnection(mysql.connector.connect(autocommit=True, **self.connect_args), statement_cache_size=self.statement_cache_size)
+        with self.lock:
+            self.counters["created"] += 1
+        return pooled
+
+    def _close(self, pooled):
+        try:
+            pooled.cnx.close()
+        except mysql.connector.Error as err:
+            logger.debug(f"Error while closing pooled connection: {err}")
+
+    def _validate(self, pooled):
+        # Only ping connections that have been idle longer than the staleness threshold
+        if monotonic() - pooled.last_used < self.stale_after:
+            return True
+        with self.lock:
+            self.counters["validated"] += 1
+        try:
+            pooled.cnx.ping(reconnect=False)
+            return True
+        except mysql.connector.Error:
+            logger.debug("Stale connection found in the pool, replacing it")
+            self._close(pooled)
+            with self.lock:
+                self.counters["replaced"] += 1
+            return False
+
+    def acquire(self):
+        deadline = monotonic() + self.timeout
+        while True:
+            pooled = None
+            with self.lock:
+                while True:
+                    if self.closed:
+                        raise PoolError("Connection pool is closed")
+                    if self.idle:
+                        pooled = self.idle.pop()
+                        break
+                    if self.opened < self.size:
+                        self.opened += 1
+                        break
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.counters["timeouts"] += 1
+                        raise PoolError(f"No connection available after {self.timeout} seconds (pool size: {self.size})")
+                    self.counters["waits"] += 1
+                    self.lock.wait(remaining)
+                self.in_use += 1
+            if pooled is None:
+                try:
+                    return self._open()
+                except Exception:
+                    with self.lock:
+                        self.opened -= 1
+                        self.in_use -= 1
+                        self.lock.notify()
+                    raise
+            if self._validate(pooled):
+                with self.lock:
+                    self.counters["reused"] += 1
+                return pooled
+            # Dead connection: free its slot and try again
+            with self.lock:
+                self.opened -= 1
+                self.in_use -= 1
+
+    def release(self, pooled, discard=False):
+        if not discard:
+            try:
+                if pooled.cnx.in_transaction:
+                    if pooled.uncommitted_writes:
+                        logger.warning("Connection returned to the pool with uncommitted writes, rolling back")
+                    pooled.cnx.rollback()
+                pooled.uncommitted_writes = False
+            except mysql.connector.Error:
+                discard = True
+        with self.lock:
+            self.in_use -= 1
+            if discard or self.closed:
+                self.opened -= 1
+                if discard:
+                    self.counters["discarded"] += 1
+            else:
+                pooled.last_used = monotonic()
+                self.idle.append(pooled)
+            self.lock.notify()
+        if discard or self.closed:
+            self._close(pooled)
+
+    def prepared(self, pooled, sql):
+        entry, hit = pooled.statements.get(pooled.cnx, sql)
+        with self.lock:
+            if hit:
+                self.counters["statement_hits"] += 1
+            else:
+                self.counters["statement_misses"] += 1
+        return entry
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled
+        except (InterfaceError, OperationalError):
+            # The connection is most likely broken, don't put it back
+            self.release(pooled, discard=True)
+            raise
+        except BaseException:
+            self.release(pooled)
+            raise
+        else:
+            self.release(pooled)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self.opened -= len(idle)
+            self.lock.notify_all()
+        for pooled in idle:
+            self._close(pooled)
+
+    def statistics(self):
+        with self.lock:
+            stats = {
+                "size": self.size,
+                "open": self.opened,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "closed": self.closed
+            }
+            stats.update(self.counters)
+        return stats
+
 # Database class
 class Database:
     # Attributes
-    connection = None
+    pool = None
     
     # Creator
-    def __init__(self, hostname, port=3306, database='information_schema', log_level=logging.INFO):
+    def __init__(self, hostname, port=3306, database='information_schema', log_level=logging.INFO, replica_ttl=300):
         self.hostname = hostname
         self.port = port
         self.schema = database
         self.auth_plugin = None
+        self.metrics = QueryMetrics(hostname=hostname)
+        self.variables = {}
+        self.roles = RoleCache(ttl=replica_ttl)
         logger.setLevel(log_level)
 
     # Methods
@@ -60,30 +1105,45 @@ class Database:
             
         }
     
-    def connect(self, username, password, schema='',auth_plugin=None,nolog=False):
-        cnx = None
+    def connect(self, username, password, schema='',auth_plugin=None,nolog=False,pool_size=5,stale_after=60,statement_cache_size=64,allow_local_infile=False):
+        if self.pool:
+            self.pool.close()
+            self.pool = None
+        connect_args = {
+            "user": username,
+            "password": password,
+            "host": self.hostname,
+            "port": self.port,
+            "database": schema
+        }
+        if auth_plugin:
+            logger.debug("Using auth_plugin for authentication")
+            connect_args["auth_plugin"] = auth_plugin
+        else:
+            logger.debug("Using defaults for authentication")
+        if allow_local_infile:
+            # Needed by Table.bulk_insert(load_data=True)
+            connect_args["allow_local_infile"] = True
+        pool = ConnectionPool(size=pool_size, stale_after=stale_after, statement_cache_size=statement_cache_size, **connect_args)
         try:
-            if auth_plugin:
-                logger.debug("Using auth_plugin for authentication")
-                cnx = mysql.connector.connect(user=username, password=password, host=self.hostname, port=self.port, database=schema,auth_plugin=auth_plugin)
-            else:
-                logger.debug("Using defaults for authentication")
-                cnx = mysql.connector.connect(user=username, password=password, host=self.hostname, port=self.port, database=schema)
+            # Open the first connection right away to validate the credentials
+            pool.release(pool.acquire())
             if not nolog:
                 logger.info(f'Database {self.schema} on {self.hostname} connected')
             self.username = username
             self.password = password
             self.auth_plugin = auth_plugin
+            self.connect_schema = schema
+            self.allow_local_infile = allow_local_infile
+            self.pool = pool
         except mysql.connector.Error as err:
+            pool.close()
             if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
                 logger.log(CRITICAL, "Something is wrong with your user name or password")
             elif err.errno == errorcode.ER_BAD_DB_ERROR:
                 logger.log(CRITICAL, "Database does not exist")
             else:
                 logger.log(CRITICAL, err)
-        finally:
-            if cnx:
-                self.connection = cnx
 
     def get_version(self):
         if self.is_connected():
@@ -95,8 +1155,8 @@ class Database:
 
     def disconnect(self):
         try:
-            if self.connection:
-                self.connection.close()
+            if self.pool:
+                self.pool.close()
                 logger.log(INFO,f'Database {self.schema} on {self.hostname} disconnected')
         except mysql.connector.Error as err:
             if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
@@ -106,67 +1166,36 @@ class Database:
             else:
                 logger.log(CRITICAL, err)
         finally:
-            self.connection = None
+            self.pool = None
 
     def reconnect(self):
+        # Rebuild the connection pool with the same credentials and settings
         if "username" in dir(self) and "password" in dir(self):
-            if self.auth_plugin:
-                self.connect(username=self.username, password=self.password, auth_plugin=self.auth_plugin, nolog=True)
-            else:
-                self.connect(username=self.username, password=self.password, nolog=True)
+            pool_size = self.pool.size if self.pool else 5
+            stale_after = self.pool.stale_after if self.pool else 60
+            statement_cache_size = self.pool.statement_cache_size if self.pool else 64
+            self.connect(username=self.username, password=self.password, schema=self.connect_schema, auth_plugin=self.auth_plugin, nolog=True, pool_size=pool_size, stale_after=stale_after, statement_cache_size=statement_cache_size, allow_local_infile=self.allow_local_infile)
+
+    def get_metrics(self, output_format='dict'):
+        # output_format: 'dict' or 'prometheus' (text exposition format)
+        if output_format == 'prometheus':
+            return self.metrics.to_prometheus()
+        return self.metrics.as_dict()
+
+    def pool_statistics(self):
+        if self.pool:
+            return self.pool.statistics()
+        return None
 
-    def execute(self,command):
-        self.reconnect()
+    def execute(self,command,params=None,result_format='dict',numpy_arrays=False,commit=False):
+        # result_format: 'dict' (list of dicts), 'tuple' (shared column list + tuples) or 'columnar' (one array per column)
+        # params: bind parameters (%s placeholders), the statement is prepared once per connection and cached
         resultset = {}
         if self.is_connected():
-            # logger.log(DEBUG, 'Database is connected. Trying to create cursor')
+            # logger.log(DEBUG, 'Database is connected. Trying to borrow a connection from the pool')
             try:
-                cursor = self.connection.cursor(buffered=True,dictionary=True)
-                # logger.log(DEBUG, 'Cursor created')
-                # logger.log(DEBUG, f'command: {command}')
-                sql = f"{command.strip(';')};"
-                # logger.log(DEBUG, f'sql: "{sql}"')
-                timer_start = datetime.now()
-                cursor.execute(sql)
-                timer_end = datetime.now()
-                timer_elapsed = timer_end - timer_start
-                # logger.log(DEBUG, 'Command executed')
-                resultset = {
-                    'rows': []
-                }
-                if command.upper().find("SELECT") == 0:
-                    rows = cursor.fetchall()
-                    # logger.log(DEBUG, f'Fetched {cursor.rowcount} rows')
-                    columns = cursor.column_names
-                    for row in rows:
-                        row_dic = {}
-                        for column in columns:
-                            row_dic[column] = row[column]
-                        resultset['rows'].append(row_dic)
-                    resultset["action"] = "SELECT"
-                    resultset["rowcount"] = cursor.rowcount
-                    resultset["start_time"] = f"{timer_start.strftime('%Y-%m-%d %H:%M:%S')}"
-                    resultset["exec_time"] = f"{timer_elapsed.total_seconds()}"
-                elif command.upper().find("SHOW") == 0:
-                    rows = cursor.fetchall()
-                    logger.debug(f'Fetched {cursor.rowcount} rows')
-                    columns = cursor.column_names
-                    for row in rows:
-                        row_dic = {}
-                        for column in columns:
-                            row_dic[column] = row[column]
-                        resultset['rows'].append(row_dic)
-                    resultset["action"] = "SELECT"
-                    resultset["rowcount"] = cursor.rowcount
-                    resultset["start_time"] = f"{timer_start.strftime('%Y-%m-%d %H:%M:%S')}"
-                    resultset["exec_time"] = f"{timer_elapsed.total_seconds()}"
-                else:
-                    logger.debug(f"RESULTSET:\n{cursor}")
-                    resultset["action"] = command.upper().split(" ")[0]
-                    resultset["rowcount"] = cursor.rowcount
-                    resultset["start_time"] = f"{timer_end.strftime('%Y-%m-%d %H:%M:%S')}"
-                    resultset["exec_time"] = f"{timer_elapsed.total_seconds()}"
-                logger.info(f"Command executed successfully in {resultset['exec_time']} s")
+                with self.pool.connection() as pooled:
+                    resultset = self.execute_on(pooled, command, params=params, result_format=result_format, numpy_arrays=numpy_arrays, commit=commit)
             except mysql.connector.Error as err:
                 logger.log(WARNING, 'Catched exception while executing')
                 logger.log(CRITICAL, err.errno)
@@ -179,7 +1208,216 @@ class Database:
                 return resultset
         else:
             logger.log(ERROR,'Please connect first, then try again')
-    
+
+    def execute_on(self, pooled, command, params=None, result_format='dict', numpy_arrays=False, commit=False):
+        # Runs a statement on an already borrowed connection, errors are raised to the caller
+        # logger.log(DEBUG, f'command: {command}')
+        if params is None:
+            cursor = pooled.cnx.cursor(buffered=True)
+            sql = f"{command.strip(';')};"
+        else:
+            cursor, sql = self.pool.prepared(pooled, command.strip().strip(';'))
+        if not commit and is_write(command):
+            # Left for the caller to commit, or rolled back when the connection is released
+            pooled.begin()
+        # logger.log(DEBUG, f'sql: "{sql}"')
+        start_time = time()
+        timer_start = perf_counter_ns()
+        try:
+            if params is None:
+                cursor.execute(sql)
+            else:
+                cursor.execute(sql, params)
+        except mysql.connector.Error:
+            if params is not None:
+                pooled.statements.discard(sql)
+            raise
+        # logger.log(DEBUG, 'Command executed')
+        resultset = {}
+        if cursor.with_rows:
+            rows = cursor.fetchall()
+            timer_elapsed = perf_counter_ns() - timer_start
+            logger.debug('Fetched %s rows', cursor.rowcount)
+            resultset.update(format_rows(rows, cursor.description, result_format, numpy_arrays))
+            resultset["action"] = "SELECT"
+            resultset["rowcount"] = cursor.rowcount
+            self.metrics.observe(sql, timer_elapsed, len(rows))
+        else:
+            timer_elapsed = perf_counter_ns() - timer_start
+            logger.debug("RESULTSET:\n%s", cursor)
+            resultset["rows"] = []
+            resultset["action"] = statement_type(command)
+            resultset["rowcount"] = cursor.rowcount
+            self.metrics.observe(sql, timer_elapsed)
+        resultset["start_time"] = start_time
+        resultset["exec_time"] = timer_elapsed / 1e9
+        if commit:
+            pooled.cnx.commit()
+        elif is_write(command):
+            pooled.uncommitted_writes = True
+        if params is None:
+            cursor.close()
+        logger.info("Command executed successfully in %s s", resultset['exec_time'])
+        return resultset
+
+    def iter_query(self, command, params=None, fetch_size=1000, batches=False, raise_errors=False):
+        # Streams the result set through an unbuffered cursor, fetch_size rows at a time.
+        # Errors end the stream quietly unless raise_errors=True, for callers that must not
+        # mistake a failed query for an empty result
+        if not self.is_connected():
+            logger.log(ERROR,'Please connect first, then try again')
+            if raise_errors:
+                raise InterfaceError(msg='Not connected')
+            return
+        try:
+            pooled = self.pool.acquire()
+        except mysql.connector.Error as err:
+            logger.log(CRITICAL, err)
+            if raise_errors:
+                raise
+            return
+        discard = False
+        try:
+            sql = command.strip().strip(';')
+            # Only the time spent in the driver counts, not the consumer's
+            timer_elapsed = 0
+            rowcount = 0
+            timer_start = perf_counter_ns()
+            cursor = pooled.cnx.cursor(buffered=False,dictionary=True)
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                timer_elapsed += perf_counter_ns() - timer_start
+                if not rows:
+                    self.metrics.observe(sql, timer_elapsed, rowcount)
+                    break
+                rowcount += len(rows)
+                if batches:
+                    yield rows
+                else:
+                    yield from rows
+                timer_start = perf_counter_ns()
+            cursor.close()
+        except (InterfaceError, OperationalError) as err:
+            discard = True
+            logger.log(WARNING, 'Catched exception while streaming')
+            logger.log(CRITICAL, err)
+            if raise_errors:
+                raise
+        except mysql.connector.Error as err:
+            logger.log(WARNING, 'Catched exception while streaming')
+            logger.log(CRITICAL, err.errno)
+            logger.log(CRITICAL, err.sqlstate)
+            logger.log(CRITICAL, err.msg)
+            if raise_errors:
+                raise
+        finally:
+            # A consumer that stops early leaves rows on the wire, closing the
+            # connection is cheaper than draining them
+            if pooled.cnx.unread_result:
+                discard = True
+            self.pool.release(pooled, discard=discard)
+
+    def run_script(self, path_or_stream, on_error='stop', batch_statements=100, batch_bytes=1048576):
+        # Runs a SQL script (path or text stream) on a single session. Statements are read lazily
+        # and sent in multi-statement batches; DELIMITER blocks and CALLs are sent on their own.
+        # on_error: 'stop' (keep what ran), 'continue' (skip failing statements) or 'rollback'
+        if on_error not in ('stop', 'continue', 'rollback'):
+            raise ValueError(f"on_error must be 'stop', 'continue' or 'rollback', not {on_error!r}")
+        if not self.is_connected():
+            logger.log(ERROR,'Please connect first, then try again')
+            return None
+        summary = {
+            "statements": 0,
+            "rowcount": 0,
+            "errors": [],
+            "status": "completed"
+        }
+        timer_start = perf_counter_ns()
+        stream = open(path_or_stream, 'r') if isinstance(path_or_stream, str) else path_or_stream
+        try:
+            with self.pool.connection() as pooled:
+                batch = []
+                batch_length = 0
+                running = True
+                for statement, delimiter in split_sql(stream, delimiters=True):
+                    standalone = delimiter != ';' or statement_type(statement) == 'CALL'
+                    if batch and (standalone or len(batch) >= batch_statements or batch_length + len(statement) > batch_bytes):
+                        running = self.run_batch(pooled, batch, on_error, summary)
+                        batch = []
+                        batch_length = 0
+                        if not running:
+                            break
+                    if standalone:
+                        running = self.run_batch(pooled, [statement], on_error, summary)
+                        if not running:
+                            break
+                    else:
+                        batch.append(statement)
+                        batch_length += len(statement)
+                if running and batch:
+                    running = self.run_batch(pooled, batch, on_error, summary)
+                if running:
+                    pooled.cnx.commit()
+        except mysql.connector.Error as err:
+            logger.log(CRITICAL, err)
+            summary["status"] = "failed"
+        finally:
+            if isinstance(path_or_stream, str):
+                stream.close()
+        summary["exec_time"] = (perf_counter_ns() - timer_start) / 1e9
+        logger.info(f"Script {summary['status']}: {summary['statements']} statements, {len(summary['errors'])} errors in {summary['exec_time']} s")
+        return summary
+
+    def run_batch(self, pooled, batch, on_error, summary):
+        # Returns False when the script has to stop
+        while batch:
+            index = 0
+            try:
+                if on_error == 'rollback':
+                    pooled.begin()
+                if len(batch) == 1:
+                    result = self.execute_on(pooled, batch[0])
+                    summary["rowcount"] += max(result["rowcount"], 0) if not result["rows"] else 0
+                    index = 1
+                else:
+                    cursor = pooled.cnx.cursor()
+                    # Newlines around the separator, a statement may end in a -- or # comment
+                    for result in cursor.execute("\n;\n".join(batch), multi=True):
+                        if result.with_rows:
+                            result.fetchall()
+                        else:
+                            summary["rowcount"] += max(result.rowcount, 0)
+                        index += 1
+                    cursor.close()
+                summary["statements"] += index
+                if on_error != 'rollback':
+                    pooled.cnx.commit()
+                return True
+            except mysql.connector.Error as err:
+                summary["statements"] += index
+                summary["errors"].append({
+                    "statement": batch[index][:200],
+                    "errno": err.errno,
+                    "sqlstate": err.sqlstate,
+                    "msg": err.msg
+                })
+                logger.log(ERROR, f"Statement failed ({err.errno}): {err.msg}")
+                if on_error == 'rollback':
+                    pooled.cnx.rollback()
+                    summary["status"] = "rolled back"
+                    return False
+                pooled.cnx.commit()
+                if on_error == 'stop':
+                    summary["status"] = "stopped"
+                    return False
+                batch = batch[index + 1:]
+        return True
+
+    def run(self, script):
+        # Runs a script given as text
+        return self.run_script(io.StringIO(script))
+
     ## Schema methods
     def load_schemas(self):
         self.schemas = self.execute('SELECT schema_name, default_character_set_name AS charset, default_collation_name as collation FROM information_schema.schemata')['rows']
@@ -188,7 +1426,7 @@ class Database:
         return self.execute('SELECT schema_name, default_character_set_name AS charset, default_collation_name as collation FROM information_schema.schemata')['rows']
     
     def get_schema(self, schema_name):
-        result = self.execute(f'SELECT schema_name, default_character_set_name AS charset, default_collation_name as collation FROM information_schema.schemata WHERE schema_name = \'{schema_name}\'')['rows']
+        result = self.execute('SELECT schema_name, default_character_set_name AS charset, default_collation_name as collation FROM information_schema.schemata WHERE schema_name = %s', params=(schema_name,))['rows']
         if len(result) > 0:
             logger.log(DEBUG, f'Schema {schema_name} found. Returning {result}')
             return result
@@ -196,10 +1434,72 @@ class Database:
             logger.log(DEBUG, f'Schema {schema_name} not found. Returning None')
             return None
     
+    def load_metadata(self, schema_names, table_names=None):
+        # Tables, columns, indexes and constraints of many schemas in four set-based queries.
+        # Returns {schema_name: {table_name: table}} where table has the layout of Schema.get_tables().
+        # Errors are raised, a partial catalog would show up as missing tables
+        schema_names = list(schema_names)
+        metadata = {schema_name: {} for schema_name in schema_names}
+        if len(schema_names) == 0:
+            return metadata
+        where = f"table_schema IN ({','.join(['%s'] * len(schema_names))})"
+        params = list(schema_names)
+        if table_names:
+            where += f" AND table_name IN ({','.join(['%s'] * len(table_names))})"
+            params += list(table_names)
+        for row in self.iter_query(f"SELECT table_schema AS schema_name, table_name AS table_name, table_type AS table_type, table_rows AS table_rows, avg_row_length AS avg_row_length, max_data_length AS max_data_length FROM information_schema.tables WHERE {where} ORDER BY 1,2", params=params, raise_errors=True):
+            metadata[row['schema_name']][row['table_name']] = table_metadata(row)
+        for row in self.iter_query(f"SELECT table_schema AS schema_name, table_name AS table_name, column_name AS column_name, ordinal_position AS ordinal_position, column_default AS column_default, is_nullable AS is_nullable, data_type AS data_type, column_type AS column_type, character_set_name AS character_set_name, collation_name AS collation_name, extra AS extra FROM information_schema.columns WHERE {where} ORDER BY 1,2,ordinal_position", params=params, raise_errors=True):
+            table = metadata[row['schema_name']].get(row['table_name'])
+            if table is not None:
+                table['columns'][row['column_name']] = column_metadata(row)
+        for row in self.iter_query(f"SELECT table_schema AS schema_name, table_name AS table_name, index_name AS index_name, non_unique AS non_unique, index_type AS index_type, column_name AS column_name, sub_part AS sub_part FROM information_schema.statistics WHERE {where} ORDER BY 1,2,index_name,seq_in_index", params=params, raise_errors=True):
+            table = metadata[row['schema_name']].get(row['table_name'])
+            if table is not None:
+                index = table['indexes'].setdefault(row['index_name'], {
+                    'non_unique': int(row['non_unique']),
+                    'index_type': row['index_type'],
+                    'columns': []
+                })
+                index['columns'].append(row['column_name'] if row['sub_part'] is None else f"{row['column_name']}({row['sub_part']})")
+        constraint_where = where.replace('table_schema', 'tc.table_schema').replace('table_name', 'tc.table_name')
+        for row in self.iter_query(f"SELECT tc.table_schema AS schema_name, tc.table_name AS table_name, tc.constraint_name AS constraint_name, tc.constraint_type AS constraint_type, kcu.column_name AS column_name, kcu.referenced_table_schema AS referenced_schema, kcu.referenced_table_name AS referenced_table, kcu.referenced_column_name AS referenced_column FROM information_schema.table_constraints tc LEFT JOIN information_schema.key_column_usage kcu ON kcu.constraint_schema = tc.constraint_schema AND kcu.constraint_name = tc.constraint_name AND kcu.table_schema = tc.table_schema AND kcu.table_name = tc.table_name WHERE {constraint_where} ORDER BY 1,2,3,kcu.ordinal_position", params=params, raise_errors=True):
+            table = metadata[row['schema_name']].get(row['table_name'])
+            if table is not None:
+                constraint = table['constraints'].setdefault(row['constraint_name'], {
+                    'constraint_type': row['constraint_type'],
+                    'columns': [],
+                    'referenced_table': f"{row['referenced_schema']}.{row['referenced_table']}" if row['referenced_table'] else None,
+                    'referenced_columns': []
+                })
+                if row['column_name'] is not None:
+                    constraint['columns'].append(row['column_name'])
+                if row['referenced_column'] is not None:
+                    constraint['referenced_columns'].append(row['referenced_column'])
+        return metadata
+
+    def load_routines(self, schema_names):
+        # Stored procedures and functions of many schemas, {schema_name: {routine_name: routine}}
+        schema_names = list(schema_names)
+        routines = {schema_name: {} for schema_name in schema_names}
+        if len(schema_names) == 0:
+            return routines
+        where = f"IN ({','.join(['%s'] * len(schema_names))})"
+        for row in self.iter_query(f"SELECT routine_schema AS schema_name, routine_name AS routine_name, routine_type AS routine_type, dtd_identifier AS returns, is_deterministic AS is_deterministic, sql_data_access AS sql_data_access, security_type AS security_type, routine_definition AS routine_definition FROM information_schema.routines WHERE routine_schema {where} ORDER BY 1,2", params=schema_names, raise_errors=True):
+            routine = dict(row)
+            del routine['schema_name']
+            routine['parameters'] = []
+            routines[row['schema_name']][row['routine_name']] = routine
+        for row in self.iter_query(f"SELECT specific_schema AS schema_name, specific_name AS routine_name, parameter_mode AS parameter_mode, parameter_name AS parameter_name, dtd_identifier AS dtd_identifier FROM information_schema.parameters WHERE specific_schema {where} AND ordinal_position > 0 ORDER BY 1,2,ordinal_position", params=schema_names, raise_errors=True):
+            routine = routines[row['schema_name']].get(row['routine_name'])
+            if routine is not None:
+                routine['parameters'].append(f"{row['parameter_mode'] + ' ' if row['parameter_mode'] and routine['routine_type'] == 'PROCEDURE' else ''}{row['parameter_name']} {row['dtd_identifier']}")
+        return routines
+
     ## User Methods
     def get_user_by_name(self, username):
         response = []
-        result = self.execute(f"SELECT user, host FROM mysql.user WHERE user = '{username}'")
+        result = self.execute("SELECT user, host FROM mysql.user WHERE user = %s", params=(username,))
         if len(result["rows"]) > 0:
             for row in result["rows"]:
                 if type(row["user"]) is bytearray:
@@ -209,7 +1509,7 @@ class Database:
         return response
 
     def get_user_by_name_host(self, username, host):
-        result = self.execute(f"SELECT user, host FROM mysql.user WHERE user = '{username}' AND host = '{host}'")
+        result = self.execute("SELECT user, host FROM mysql.user WHERE user = %s AND host = %s", params=(username, host))
         if result["rowcount"] == 1:
             if type(result["rows"][0]["user"]) is bytearray:
                 return User(database=self, username=result["rows"][0]["user"].decode(), host=result["rows"][0]["host"].decode())
@@ -222,13 +1522,62 @@ class Database:
     def dump(self):
         return None
 
+    @contextmanager
+    def transaction(self):
+        # Pins one pooled connection for several statements (use execute_on), commits on
+        # success and rolls back if anything fails
+        with self.pool.connection() as pooled:
+            try:
+                pooled.begin()
+                yield pooled
+            except BaseException:
+                try:
+                    pooled.cnx.rollback()
+                except mysql.connector.Error as err:
+                    logger.log(WARNING, f"Rollback failed: {err}")
+                raise
+            else:
+                pooled.cnx.commit()
+
+    ## Server status methods
+    def get_replica_lag(self):
+        # Seconds_Behind_Master, None if this is not a replica or replication is broken
+        result = self.execute("SHOW SLAVE STATUS")
+        if result and len(result["rows"]) > 0:
+            return result["rows"][0]["Seconds_Behind_Master"]
+        return None
+
+    def is_replica(self, ttl=None):
+        # Cached for replica_ttl seconds (see RoleCache), ttl overrides it for this call only.
+        # None when the role can't be read
+        def probe():
+            result = self.execute("SHOW SLAVE STATUS")
+            if result is None or "rows" not in result:
+                return None
+            return len(result["rows"]) > 0
+        return self.roles.is_replica(self, probe, ttl=ttl)
+
+    def get_global_status(self, variable):
+        result = self.execute(f"SHOW GLOBAL STATUS LIKE '{variable}'")
+        if result and len(result["rows"]) > 0:
+            return result["rows"][0]["Value"]
+        return None
+
+    def get_variable(self, variable):
+        # Global/session variables used for sizing decisions, cached per Database
+        if variable not in self.variables:
+            result = self.execute(f"SELECT @@{variable} AS value")
+            if result and len(result["rows"]) > 0:
+                self.variables[variable] = result["rows"][0]["value"]
+        return self.variables.get(variable)
+
     # Flush Privileges
     def flush_privileges(self):
         return self.execute(command = "FLUSH PRIVILEGES;")
 
     # Check if there's an active connection to the database
     def is_connected(self):
-        if self.connection:
+        if self.pool:
             return True
         else:
             return False
@@ -246,39 +1595,22 @@ class Schema:
         else:
             self.name = 'NotFound'
 
-    def load_tables(self):
-        self.tables = self.get_tables()
+    def load_tables(self, cache=None):
+        if cache is None:
+            self.tables = self.get_tables()
+        else:
+            self.tables = cache.get_tables(self.database, self.name)
 
     def get_tables(self):
-        result = self.database.execute(f"SELECT table_schema AS schema_name, table_name, table_type, table_rows, avg_row_length, max_data_length FROM information_schema.tables WHERE table_schema = '{self.name}' ORDER by 1,2")
-        tables = {}
-        for row in result['rows']:
-            tables[f"{row['table_name']}"] = {
-                'schema_name': row['schema_name'],
-                'table_name': row['table_name'],
-                'full_name': f"{row['schema_name']}.{row['table_name']}",
-                'table_type': row['table_type'],
-                'table_rows': row['table_rows'],
-                'avg_row_length': row['avg_row_length'],
-                'max_data_length': row['max_data_length']
-            }
-        # logger.log(DEBUG, f"Tables is: {tables}")
-        for table_name in tables.keys():
-            table = Table(schema = self, name=table_name)
-            tables[table_name]['columns'] = table.get_columns()
-        return tables
+        return self.database.load_metadata([self.name])[self.name]
     
     def get_table(self, table_name):
-        result = self.database.execute(f"SELECT table_schema AS schema_name, table_name, table_type, table_rows, avg_row_length, max_data_length FROM information_schema.tables WHERE table_schema = '{self.name}' AND table_name = '{table_name}' ORDER by 1,2")
-        table = {}
-        if len(result) > 0:
-            table[f"{result['table_name']}"] = result[0]
-        # logger.log(DEBUG, f"Table is: {table}")
-        table_obj = Table(self, table_name)
-        table['columns'] = table_obj.get_columns()
-        return table
+        return self.database.load_metadata([self.name], [table_name])[self.name].get(table_name, {'columns': {}})
 
-    def compare(self, schema, gen_fix_script=False):
+    def load_routines(self):
+        self.routines = self.database.load_routines([self.name])[self.name]
+
+    def compare(self, schema, gen_fix_script=False, cache=None, allow_drops=False):
         # Check there is a valid connection in both databases
         logger.log(DEBUG, f'Checking connectivity to {self.database.hostname} and {schema.database.hostname}')
         if self.database.is_connected() and schema.database.is_connected():
@@ -289,83 +1621,21 @@ class Schema:
             if remote_schema.name != 'NotFound':
                 logger.log(DEBUG, f'Remote Schema is: {remote_schema.name}')
                 # Get colunms definitions and compare
-                local_schema.load_tables()
-                # logger.log(DEBUG, f'Local Schema Tables: {local_schema.tables}')
-                remote_schema.load_tables()
-                # logger.log(DEBUG, f'Remote Schema Tables: {remote_schema.tables}')
-                diff_dict = {
-                    'differences': [],
-                    'fix_commands': []
-                }
-                for table_entry in local_schema.tables.keys():
-                    if table_entry in remote_schema.tables.keys():
-                        logger.log(DEBUG, f"Checking table {table_entry}")
-                        for column in local_schema.tables[table_entry]['columns'].keys():
-                            if column in remote_schema.tables[table_entry]['columns'].keys():
-                                # logger.log(DEBUG, f"Checking column {column}")
-                                for key in local_schema.tables[table_entry]['columns'][column].keys():
-                                    if key != 'ordinal_position':
-                                        if local_schema.tables[table_entry]['columns'][column][key] != remote_schema.tables[table_entry]['columns'][column][key]:
-                                            fix_command = f"ALTER TABLE {table_entry} MODIFY COLUMN "
-                                            fix_command += f"{column} {local_schema.tables[table_entry]['columns'][column]['column_type']}"
-                                            if local_schema.tables[table_entry]['columns'][column]['is_nullable'] == 'NO':
-                                                fix_command += ' NOT NULL'
-                                            if local_schema.tables[table_entry]['columns'][column]['column_default'] is not None:
-                                                if local_schema.tables[table_entry]['columns'][column]['data_type'] == 'varchar':
-                                                    fix_command += f" DEFAULT '{local_schema.tables[table_entry]['columns'][column]['column_default']}'"
-                                                else:
-                                                    fix_command += f" DEFAULT {local_schema.tables[table_entry]['columns'][column]['column_default']}"
-                                            fix_command += ";"
-                                            diff_dict['differences'].append({
-                                                table_entry: {
-                                                    column:{
-                                                        local_schema.database.hostname: {
-                                                            key: local_schema.tables[table_entry]['columns'][column][key]
-                                                        },
-                                                        remote_schema.database.hostname: {
-                                                            key: remote_schema.tables[table_entry]['columns'][column][key]
-                                                        }
-                                                    }
-                                                }
-                                            })
-                                            diff_dict['fix_commands'].append(fix_command)
-                            else:
-                                fix_command = f"ALTER TABLE {table_entry} ADD COLUMN "
-                                fix_command += f"{column} {local_schema.tables[table_entry]['columns'][column]['column_type']}"
-                                if local_schema.tables[table_entry]['columns'][column]['is_nullable'] == 'NO':
-                                    fix_command += ' NOT NULL'
-                                if local_schema.tables[table_entry]['columns'][column]['column_default'] is not None:
-                                    if local_schema.tables[table_entry]['columns'][column]['data_type'] == 'varchar':
-                                        fix_command += f" DEFAULT '{local_schema.tables[table_entry]['columns'][column]['column_default']}'"
-                                    else:
-                                        fix_command += f" DEFAULT {local_schema.tables[table_entry]['columns'][column]['column_default']}"
-                                fix_command += ";"
-                                diff_dict['differences'].append({
-                                    table_entry: {
-                                        column:{
-                                            local_schema.database.hostname: {
-                                                'column_exists': True
-                                            },
-                                            remote_schema.database.hostname: {
-                                                'column_exists': False
-                                            }
-                                        }
-                                    }
-                                })
-                                diff_dict['fix_commands'].append(fix_command)
-                    else:
-                        diff_dict['differences'].append({
-                            self.name: {
-                                local_schema.database.hostname: {
-                                    'schema_exists': True
-                                },
-                                remote_schema.database.hostname: {
-                                    'schema_exists': False
-                                }
-                            }
-                        })
-                return diff_dict
-        # TO-DO: Get functions definitions and compare
+                try:
+                    local_schema.load_tables(cache)
+                    # logger.log(DEBUG, f'Local Schema Tables: {local_schema.tables}')
+                    remote_schema.load_tables(cache)
+                    # logger.log(DEBUG, f'Remote Schema Tables: {remote_schema.tables}')
+                    local_schema.load_routines()
+                    remote_schema.load_routines()
+                except mysql.connector.Error as err:
+                    # Comparing against a partial catalog would report tables that do exist as missing
+                    logger.log(WARNING, 'Catched exception while loading the schema metadata')
+                    logger.log(CRITICAL, err.errno)
+                    logger.log(CRITICAL, err.sqlstate)
+                    logger.log(CRITICAL, err.msg)
+                    return None
+                return compare_tables(local_schema.tables, remote_schema.tables, local_schema.database.hostname, remote_schema.database.hostname, self.name, local_schema.routines, remote_schema.routines, allow_drops=allow_drops)
         return None
 
 # Table class
@@ -378,23 +1648,20 @@ class Table:
     
     def get_columns(self):
         # logger.log(DEBUG, f"Table is: {table_name}")
-        result = self.database.execute(f"SELECT column_name, ordinal_position, column_default, is_nullable, data_type, column_type, character_set_name, collation_name FROM information_schema.columns WHERE table_schema = '{self.schema.name}' AND table_name = '{self.name}' ORDER BY ordinal_position")
+        result = self.database.execute("SELECT column_name AS column_name, ordinal_position AS ordinal_position, column_default AS column_default, is_nullable AS is_nullable, data_type AS data_type, column_type AS column_type, character_set_name AS character_set_name, collation_name AS collation_name, extra AS extra FROM information_schema.columns WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position", params=(self.schema.name, self.name))
         column_dict = {}
         for column in result['rows']:
             # logger.log(DEBUG, column)
-            column_dict[column['column_name']] = {
-                'ordinal_position': column['ordinal_position'],
-                'column_default': column['column_default'],
-                'is_nullable': column['is_nullable'],
-                'data_type': column['data_type'],
-                'column_type': column['column_type'],
-                'charset': column['character_set_name'],
-                'collation': column['collation_name'],
-            }
+            column_dict[column['column_name']] = column_metadata(column)
         return column_dict
 
-    def get_rowcount(self):
+    def get_rowcount(self, estimate=False):
         logger.log(DEBUG,'Getting ROWCOUNT')
+        if estimate:
+            # InnoDB's sampled estimate from the data dictionary, no table scan
+            result = self.database.execute('SELECT table_rows AS rowcount FROM information_schema.tables WHERE table_schema = %s AND table_name = %s', params=(self.schema.name, self.name))
+            if len(result.get('rows', [])) > 0:
+                return result['rows'][0]
         return self.database.execute(f'SELECT count(1) AS rowcount FROM {self.fqn}')['rows'][0]
 
     def get_insert_statement(self, columns: list = None, values: list = None):
@@ -413,10 +1680,139 @@ class Table:
             
         return sql
 
-    def insert(self, values: list):
-        None
+    def insert(self, values: list, columns: list = None):
+        return self.bulk_insert([values], columns=columns)
+
+    def bulk_insert(self, rows, columns: list = None, batch_rows=1000, batch_bytes=None, batches_per_transaction=1, load_data=False):
+        # Loads an iterable of rows (dicts or sequences) with multi-row INSERTs through executemany.
+        # Batches are capped by batch_rows and batch_bytes (defaults to max_allowed_packet).
+        # load_data=True spools the rows to a temporary file and uses LOAD DATA LOCAL INFILE
+        # (the Database has to be connected with allow_local_infile=True)
+        rows = iter(rows)
+        first = next(rows, None)
+        summary = {
+            "rowcount": 0,
+            "batches": 0
+        }
+        if first is None:
+            return summary
+        if columns is None:
+            columns = list(first.keys()) if isinstance(first, dict) else list(self.get_columns().keys())
+        if isinstance(first, dict):
+            rows = (tuple(row[column] for column in columns) for row in chain([first], rows))
+        else:
+            rows = chain([first], rows)
+        column_list = ','.join(columns)
+        timer_start = monotonic()
+        try:
+            if load_data:
+                self.load_data(rows, columns, summary)
+            else:
+                if batch_bytes is None:
+                    # Leave room for the statement text and protocol overhead
+                    batch_bytes = int(self.database.get_variable('max_allowed_packet') or 4194304) - 16384
+                sql = f"INSERT INTO {self.fqn} ({column_list}) VALUES ({','.join(['%s'] * len(columns))})"
+                with self.database.pool.connection() as pooled:
+                    cursor = pooled.cnx.cursor()
+                    batch = []
+                    size = 0
+                    for row in rows:
+                        # Rough size in bytes of the row once rendered as literals (text is sent as utf-8)
+                        row_size = 8 + sum(2 * len(value) if isinstance(value, (bytes, bytearray)) else len(str(value).encode()) + 3 for value in row)
+                        if batch and (len(batch) >= batch_rows or size + row_size > batch_bytes):
+                            self.insert_batch(pooled, cursor, sql, batch, summary, batches_per_transaction)
+                            batch = []
+                            size = 0
+                        batch.append(row)
+                        size += row_size
+                    if batch:
+                        self.insert_batch(pooled, cursor, sql, batch, summary, batches_per_transaction)
+                    pooled.cnx.commit()
+                    cursor.close()
+        except mysql.connector.Error as err:
+            logger.log(WARNING, f'Catched exception while loading {self.fqn}')
+            logger.log(CRITICAL, err.errno)
+            logger.log(CRITICAL, err.sqlstate)
+            logger.log(CRITICAL, err.msg)
+            summary["error"] = err.msg
+        summary["exec_time"] = monotonic() - timer_start
+        summary["rows_per_second"] = summary["rowcount"] / summary["exec_time"] if summary["exec_time"] > 0 else 0
+        logger.info(f"{self.fqn}: {summary['rowcount']} rows loaded in {summary['exec_time']:.1f} s ({int(summary['rows_per_second'])} rows/s)")
+        return summary
+
+    def insert_batch(self, pooled, cursor, sql, batch, summary, batches_per_transaction=1):
+        # The connector rewrites executemany INSERTs into a single multi-row INSERT
+        pooled.begin()
+        timer_start = perf_counter_ns()
+        cursor.executemany(sql, batch)
+        self.database.metrics.observe(sql, perf_counter_ns() - timer_start)
+        summary["rowcount"] += len(batch)
+        summary["batches"] += 1
+        if summary["batches"] % batches_per_transaction == 0:
+            pooled.cnx.commit()
+
+    def load_data(self, rows, columns, summary):
+        # Writes the rows in LOAD DATA's default text format (tab separated, backslash escaped, \N for NULL)
+        spool = NamedTemporaryFile(mode='wb', suffix='.tsv', delete=False)
+        try:
+            with spool:
+                for row in rows:
+                    spool.write(b'\t'.join(tsv_value(value) for value in row) + b'\n')
+                    summary["rowcount"] += 1
+            sql = f"LOAD DATA LOCAL INFILE %s INTO TABLE {self.fqn} ({','.join(columns)})"
+            with self.database.transaction() as pooled:
+                cursor = pooled.cnx.cursor()
+                timer_start = perf_counter_ns()
+                cursor.execute(sql, (spool.name,))
+                self.database.metrics.observe(sql, perf_counter_ns() - timer_start)
+                summary["rowcount"] = cursor.rowcount
+                summary["batches"] = 1
+                cursor.close()
+        finally:
+            os.remove(spool.name)
     
-    def delete(self, rows: list, batch_size = 1, delay = 0):
+    def get_primary_key(self):
+        # Primary key columns in key order, falls back to the first unique index
+        result = self.database.execute("SELECT index_name AS index_name, column_name AS column_name FROM information_schema.statistics WHERE table_schema = %s AND table_name = %s AND non_unique = 0 ORDER BY index_name = 'PRIMARY' DESC, index_name, seq_in_index", params=(self.schema.name, self.name))
+        key = []
+        key_index = None
+        for row in result.get('rows', []):
+            if key_index is None:
+                key_index = row['index_name']
+            elif row['index_name'] != key_index:
+                break
+            key.append(row['column_name'])
+        return key
+
+    def throttle(self, max_replica_lag=None, max_threads_running=None, replicas=None, check_interval=1, max_wait=600):
+        # Waits until every replica is within max_replica_lag seconds and the server runs at most
+        # max_threads_running threads. Returns the seconds spent waiting, raises TimeoutError after
+        # max_wait seconds (a stopped replica never catches up, None waits forever)
+        waited = 0
+        while True:
+            reasons = []
+            if max_threads_running is not None:
+                threads_running = self.database.get_global_status('Threads_running')
+                if threads_running is not None and int(threads_running) > max_threads_running:
+                    reasons.append(f"Threads_running is {threads_running}")
+            if max_replica_lag is not None:
+                for replica in replicas or []:
+                    lag = replica.get_replica_lag()
+                    if lag is None:
+                        reasons.append(f"replication is not running on {replica.hostname}")
+                    elif lag > max_replica_lag:
+                        reasons.append(f"{replica.hostname} is {lag} s behind")
+            if not reasons:
+                return waited
+            if max_wait is not None and waited >= max_wait:
+                logger.error(f"Giving up on {self.fqn} after waiting {waited} s: {', '.join(reasons)}")
+                raise TimeoutError(f"{', '.join(reasons)} after waiting {waited} s")
+            logger.info(f"Throttling {self.fqn}: {', '.join(reasons)}")
+            sleep(check_interval)
+            waited += check_interval
+
+    def delete(self, rows: list, batch_size = 1, delay = 0, batches_per_transaction = 1, max_replica_lag = None, max_threads_running = None, replicas = None, max_wait = 600):
+        # rows are dicts of key column values, every batch is one DELETE ... WHERE key IN (...)
         full_result = {
             "rows": []
         }
@@ -424,136 +1820,420 @@ class Table:
             logger.warning("No IDs found!")
             full_result["rowcount"] = 0
         else:
-            if batch_size == 1:
-                for row in rows:
-                    conditions = []
-                    for column in row.keys():
-                        conditions.append((column,row[column]))
-                    for condition in conditions:
-                        logger.debug(f"Condition value type is: {type(condition[1])}")
-                        if type(condition[1]) is str:
-                            logger.debug(f"Full command: DELETE FROM {self.fqn} WHERE {condition[0]} = '{condition[1]}'; COMMIT;")
-                            result = self.database.execute(command=f"DELETE FROM {self.fqn} WHERE {condition[0]} = '{condition[1]}'; COMMIT;")
-                        else:
-                            logger.debug(f"Full command: DELETE FROM {self.fqn} WHERE {condition[0]} = {condition[1]}; COMMIT;")
-                            result = self.database.execute(command=f"DELETE FROM {self.fqn} WHERE {condition[0]} = {condition[1]}; COMMIT;")
-                        full_result["rows"].append(result)
-            elif batch_size > 1:
-                str_conditions = ""
-                counter = 0
-                for row in rows:
-                    conditions = []
-                    for column in row.keys():
-                        conditions.append((column,row[column]))
-                    for condition in conditions:
-                        str_conditions += f"{condition[1]},"
-                    counter+=1
-                    if counter == batch_size or row == rows[len(rows)-1]:
-                        str_conditions = str_conditions[:(len(str_conditions)-1)]
-                        cond_string = f"{condition[0]} IN ('" + str_conditions.replace(",","','") + "')"
-                        full_command = f"DELETE FROM {self.fqn} WHERE {cond_string}; COMMIT;"
-                        # logger.debug(f"Full command: {full_command}")
+            columns = list(rows[0].keys())
+            if len(columns) == 1:
+                key = columns[0]
+                placeholder = "%s"
+            else:
+                key = f"({','.join(columns)})"
+                placeholder = f"({','.join(['%s'] * len(columns))})"
+            timer_start = monotonic()
+            deleted = 0
+            for transaction_start in range(0, len(rows), batch_size * batches_per_transaction):
+                self.throttle(max_replica_lag=max_replica_lag, max_threads_running=max_threads_running, replicas=replicas, max_wait=max_wait)
+                with self.database.transaction() as pooled:
+                    for batch_start in range(transaction_start, min(transaction_start + batch_size * batches_per_transaction, len(rows)), batch_size):
+                        batch = rows[batch_start:batch_start + batch_size]
+                        values = [row[column] for row in batch for column in columns]
+                        # Full batches share the same statement text, so the prepared statement is reused
+                        full_command = f"DELETE FROM {self.fqn} WHERE {key} IN ({','.join([placeholder] * len(batch))})"
                         logger.debug("Executing DELETE!")
-                        result=self.database.execute(command=full_command)
-                        counter=0
-                        str_conditions = ""
+                        result = self.database.execute_on(pooled, full_command, params=values)
+                        deleted += max(result["rowcount"], 0)
                         full_result["rows"].append(result)
-                        if delay > 0:
-                            logger.debug("Found delay")
-                            t = delay
-                            while t > 0:
-                                print(f"Waiting for {t} seconds...", end="\r")
-                                sleep(1)
-                                t -= 1
+                elapsed = monotonic() - timer_start
+                logger.info(f"{self.fqn}: {deleted} rows deleted, {int(deleted / elapsed) if elapsed > 0 else deleted} rows/s")
+                if delay > 0:
+                    logger.debug("Found delay")
+                    sleep(delay)
+            full_result["rowcount"] = deleted
         return(full_result)
 
+    def purge(self, where=None, params=None, chunk_size=1000, chunks_per_transaction=1, target_chunk_time=0.5, max_chunk_size=50000, max_replica_lag=None, max_threads_running=None, replicas=None, report_every=10, max_wait=600):
+        # Deletes the rows matching `where` walking the primary key in keyset chunks. Chunk size
+        # adapts to target_chunk_time seconds per chunk and every transaction waits for capacity first
+        key = self.get_primary_key()
+        if not key:
+            logger.error(f"{self.fqn} has no primary key or unique index, can't purge by ranges")
+            return None
+        key_list = ','.join(key)
+        key_tuple = f"({key_list})"
+        key_placeholders = f"({','.join(['%s'] * len(key))})"
+        condition = f" AND ({where})" if where else ""
+        params = list(params or [])
+        summary = {
+            "rowcount": 0,
+            "chunks": 0,
+            "transactions": 0
+        }
+        last_key = None
+        timer_start = monotonic()
+        finished = False
+        while not finished:
+            self.throttle(max_replica_lag=max_replica_lag, max_threads_running=max_threads_running, replicas=replicas, max_wait=max_wait)
+            with self.database.transaction() as pooled:
+                for chunk in range(chunks_per_transaction):
+                    chunk_start = monotonic()
+                    # Upper bound of the next chunk: the chunk_size-th matching key after the last one
+                    if last_key is None:
+                        lower = ""
+                        lower_params = []
+                    else:
+                        lower = f" AND {key_tuple} > {key_placeholders}"
+                        lower_params = list(last_key)
+                    result = self.database.execute_on(pooled, f"SELECT {key_list} FROM {self.fqn} WHERE 1=1{lower}{condition} ORDER BY {key_list} LIMIT %s", params=lower_params + params + [chunk_size], result_format='tuple')
+                    if len(result["rows"]) == 0:
+                        finished = True
+                        break
+                    upper_key = list(result["rows"][-1])
+                    result = self.database.execute_on(pooled, f"DELETE FROM {self.fqn} WHERE {key_tuple} <= {key_placeholders}{lower}{condition}", params=upper_key + lower_params + params)
+                    summary["rowcount"] += max(result["rowcount"], 0)
+                    summary["chunks"] += 1
+                    last_key = upper_key
+                    # Grow or shrink the next chunk towards the target latency (at most x2 / x0.5)
+                    chunk_time = monotonic() - chunk_start
+                    if chunk_time > 0:
+                        factor = min(max(target_chunk_time / chunk_time, 0.5), 2)
+                        chunk_size = min(max(int(chunk_size * factor), 1), max_chunk_size)
+                    if summary["chunks"] % report_every == 0:
+                        elapsed = monotonic() - timer_start
+                        logger.info(f"{self.fqn}: {summary['rowcount']} rows purged in {summary['chunks']} chunks, {int(summary['rowcount'] / elapsed)} rows/s, chunk size {chunk_size}")
+            summary["transactions"] += 1
+        summary["exec_time"] = monotonic() - timer_start
+        summary["rows_per_second"] = summary["rowcount"] / summary["exec_time"] if summary["exec_time"] > 0 else 0
+        logger.info(f"{self.fqn}: purge finished, {summary['rowcount']} rows in {summary['exec_time']:.1f} s ({int(summary['rows_per_second'])} rows/s)")
+        return summary
+
     
     def update(self, id: list, columns: list, values: list):
-        None
+        # Sets columns to values on the rows whose primary key is in id. With a composite
+        # primary key every id is a tuple with a value for each key column
+        key = self.get_primary_key()
+        if not key or len(id) == 0:
+            return None
+        assignments = ','.join(f"{column} = %s" for column in columns)
+        if len(key) == 1:
+            keys = [row_key[0] if isinstance(row_key, (list, tuple)) else row_key for row_key in id]
+            condition = f"{key[0]} IN ({','.join(['%s'] * len(keys))})"
+        else:
+            keys = []
+            for row_key in id:
+                if not isinstance(row_key, (list, tuple)) or len(row_key) != len(key):
+                    raise ValueError(f"{self.fqn} has the primary key ({','.join(key)}), every id needs {len(key)} values")
+                keys.extend(row_key)
+            placeholders = '(' + ','.join(['%s'] * len(key)) + ')'
+            condition = f"({','.join(key)}) IN ({','.join([placeholders] * len(id))})"
+        return self.database.execute(f"UPDATE {self.fqn} SET {assignments} WHERE {condition}", params=list(values) + keys, commit=True)
+
+    def scan(self, batch_size=1000, columns=None, where=None, params=None, start_after=None, checkpoint=None, batches=False):
+        # Reads the whole table (or the rows matching `where`) in primary key order with keyset
+        # pagination, so every page costs the same no matter how deep the scan is. Key columns are
+        # always selected. With checkpoint=<path> the last key of every consumed batch is saved and
+        # an interrupted scan resumes after it; the file is removed once the scan completes.
+        # A failing page raises mysql.connector.Error and keeps the checkpoint
+        key = self.get_primary_key()
+        if not key:
+            logger.error(f"{self.fqn} has no primary key or unique index, can't scan by ranges")
+            return
+        if not self.database.is_connected():
+            logger.log(ERROR,'Please connect first, then try again')
+            return
+        key_list = ','.join(key)
+        select_list = '*' if columns is None else ','.join(list(columns) + [column for column in key if column not in columns])
+        condition = f" AND ({where})" if where else ""
+        params = list(params or [])
+        rows_read = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+            if saved.get('table') == self.fqn and saved.get('key_columns') == key:
+                start_after = saved['last_key']
+                rows_read = saved['rows']
+                logger.info(f"{self.fqn}: resuming scan after {start_after} ({rows_read} rows already read)")
+        last_key = list(start_after) if start_after is not None else None
+        while True:
+            lower, lower_params = range_condition(key, last_key, None)
+            # execute() would turn an error into an empty page, which looks like the end of the table
+            with self.database.pool.connection() as pooled:
+                result = self.database.execute_on(pooled, f"SELECT {select_list} FROM {self.fqn} WHERE {lower}{condition} ORDER BY {key_list} LIMIT %s", params=lower_params + params + [batch_size])
+            rows = result["rows"]
+            if len(rows) == 0:
+                break
+            if batches:
+                yield rows
+            else:
+                yield from rows
+            # The consumer asked for more, so the whole batch has been processed
+            last_key = [rows[-1][column] for column in key]
+            rows_read += len(rows)
+            if checkpoint:
+                with open(f"{checkpoint}.tmp", 'w') as checkpoint_file:
+                    json.dump({'table': self.fqn, 'key_columns': key, 'last_key': last_key, 'rows': rows_read}, checkpoint_file, default=str)
+                os.replace(f"{checkpoint}.tmp", checkpoint)
+            if len(rows) < batch_size:
+                break
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def iter_chunks(self, chunk_size=10000, key=None):
+        # Splits the table in primary key ranges of about chunk_size rows, yields (lower, upper)
+        # key tuples where lower is exclusive and upper inclusive. None means unbounded, so the
+        # ranges also cover keys that only exist on another server. A failed boundary lookup
+        # raises mysql.connector.Error rather than ending the walk with an unbounded range
+        if not self.database.is_connected():
+            raise InterfaceError(msg='Not connected')
+        key = key or self.get_primary_key()
+        key_list = ','.join(key)
+        lower = None
+        while True:
+            condition, params = range_condition(key, lower, None)
+            with self.database.pool.connection() as pooled:
+                result = self.database.execute_on(pooled, f"SELECT {key_list} FROM {self.fqn} WHERE {condition} ORDER BY {key_list} LIMIT %s, 1", params=params + [chunk_size - 1], result_format='tuple')
+            if len(result["rows"]) == 0:
+                yield lower, None
+                return
+            upper = tuple(result["rows"][0])
+            yield lower, upper
+            lower = upper
 
-    def compare_data(self, table, batch_size=10000,print_to_console=False,fix_script=False,fix=False):
-        column_names = ""
-        if self.database.is_connected() and table.database.is_connected:
+    def checksum(self, lower=None, upper=None, key=None, columns=None, algorithm='crc32'):
+        # Row count and order independent checksum of a key range computed server side
+        # (BIT_XOR of a per-row CRC32 or 64 bit MD5 prefix, NULLs told apart from empty values)
+        key = key or self.get_primary_key()
+        if columns is None:
+            columns = list(self.get_columns().keys())
+        row = row_expression(columns)
+        if algorithm == 'md5':
+            row_hash = f"CAST(CONV(SUBSTRING(MD5({row}), 1, 16), 16, 10) AS UNSIGNED)"
+        else:
+            row_hash = f"CRC32({row})"
+        condition, params = range_condition(key, lower, upper)
+        result = self.database.execute(f"SELECT COUNT(*) AS row_count, COALESCE(BIT_XOR({row_hash}), 0) AS checksum FROM {self.fqn} WHERE {condition}", params=params)
+        if len(result.get("rows", [])) == 0:
+            return None
+        return int(result["rows"][0]["row_count"]), int(result["rows"][0]["checksum"])
+
+    def compare_chunk(self, table, lower, upper, key, columns, algorithm='crc32'):
+        # Compares one key range with the same range of table. Rows are only fetched when the
+        # checksums differ. Returns None when either side could not be compared
+        local_checksum = self.checksum(lower, upper, key, columns, algorithm)
+        remote_checksum = table.checksum(lower, upper, key, columns, algorithm)
+        if local_checksum is None or remote_checksum is None:
+            return None
+        diff = {
+            "lower": lower,
+            "upper": upper,
+            "different": local_checksum != remote_checksum,
+            "rows_fetched": 0,
+            "missing_local": [],
+            "missing_remote": [],
+            "conflicts": []
+        }
+        if not diff["different"]:
+            return diff
+        logger.debug(f"Chunk {lower} - {upper} differs: {local_checksum} vs {remote_checksum}")
+        try:
+            for event, local_row, remote_row in self.diff_rows(table, lower, upper, key, columns):
+                diff["rows_fetched"] += (local_row is not None) + (remote_row is not None)
+                if event == 'changed':
+                    diff["conflicts"].append((local_row, remote_row))
+                elif event == 'missing_remote':
+                    diff["missing_remote"].append(local_row)
+                else:
+                    diff["missing_local"].append(remote_row)
+        except mysql.connector.Error:
+            # A side that failed to stream would look like missing rows, report the chunk as failed instead
+            return None
+        return diff
+
+    def iter_row_hashes(self, lower=None, upper=None, key=None, columns=None, fetch_size=10000):
+        # Streams (key tuple, row hash) in key order. String keys are sorted by their bytes so
+        # the server order matches Python's tuple comparison used by merge_join
+        key = key or self.get_primary_key()
+        column_types = {column: attributes['data_type'] for column, attributes in self.get_columns().items()}
+        if columns is None:
+            columns = list(column_types.keys())
+        order = ','.join(f"CAST({column} AS BINARY)" if column_types.get(column) in STRING_TYPES else column for column in key)
+        condition, params = range_condition(key, lower, upper)
+        for row in self.database.iter_query(f"SELECT {','.join(key)}, MD5({row_expression(columns)}) AS row_hash FROM {self.fqn} WHERE {condition} ORDER BY {order}", params=params, fetch_size=fetch_size, raise_errors=True):
+            yield tuple(row[column] for column in key), row['row_hash']
+
+    def get_rows_by_key(self, keys, key=None):
+        # {key tuple: row} for a list of key tuples
+        key = key or self.get_primary_key()
+        if len(keys) == 0:
+            return {}
+        row_placeholders = f"({','.join(['%s'] * len(key))})"
+        rows = self.database.iter_query(f"SELECT * FROM {self.fqn} WHERE ({','.join(key)}) IN ({','.join([row_placeholders] * len(keys))})", params=[value for row_key in keys for value in row_key], raise_errors=True)
+        return {tuple(row[column] for column in key): row for row in rows}
+
+    def diff_rows(self, table, lower=None, upper=None, key=None, columns=None, batch_size=500):
+        # Streaming merge-join of both tables' (key, row hash) streams over a key range. Yields
+        # ('missing_remote', local_row, None), ('missing_local', None, remote_row) and
+        # ('changed', local_row, remote_row); full rows are only fetched for those keys,
+        # batch_size keys at a time, so memory does not depend on the range size
+        key = key or self.get_primary_key()
+        pending = []
+        def materialize():
+            local_rows = self.get_rows_by_key([row_key for event, row_key in pending if event != 'missing_local'], key)
+            remote_rows = table.get_rows_by_key([row_key for event, row_key in pending if event != 'missing_remote'], key)
+            for event, row_key in pending:
+                local_row, remote_row = local_rows.get(row_key), remote_rows.get(row_key)
+                # On a live table a key can be gone by the time its row is fetched
+                if local_row is None and remote_row is None:
+                    continue
+                if local_row is None:
+                    if event == 'missing_remote':
+                        continue
+                    event = 'missing_local'
+                elif remote_row is None:
+                    if event == 'missing_local':
+                        continue
+                    event = 'missing_remote'
+                yield event, local_row, remote_row
+        for event, row_key in merge_join(self.iter_row_hashes(lower, upper, key, columns), table.iter_row_hashes(lower, upper, key, columns)):
+            pending.append((event, row_key))
+            if len(pending) >= batch_size:
+                yield from materialize()
+                pending = []
+        if pending:
+            yield from materialize()
+
+    def compare_data(self, table, batch_size=10000,print_to_console=False,fix_script=False,fix=False,algorithm='crc32',delete_extra=True):
+        # Checksums both tables in primary key chunks of batch_size rows and only fetches
+        # the rows of chunks whose checksum or row count differ. fix_script is True (stdout),
+        # a path or a stream to write the repair statements to, fix=True applies them to the
+        # remote table. With delete_extra=False rows only found remotely are copied to the
+        # local table instead of being deleted
+        if self.database.is_connected() and table.database.is_connected():
             logger.log(INFO,f'Comparing {self.fqn} on {self.database.hostname} and {table.database.hostname}')
-            logger.log(DEBUG,'Connections verified, starting comparison')
-            local_rowcount = self.get_rowcount()['rowcount']
-            logger.log(DEBUG,f'Local Rows: {local_rowcount}')
-            remote_rowcount = table.get_rowcount()['rowcount']
-            logger.log(DEBUG,f'Remote Rows: {remote_rowcount}')
-            if local_rowcount != remote_rowcount:
-                logger.log(WARNING,f'Local and remote row counts differ!')
-            processed = 0
-            if fix_script:
-                local_script = ""
-                remote_script = ""
-            while processed < local_rowcount or processed < remote_rowcount:
-                local_result = self.database.execute(f'SELECT * FROM {self.schema.name}.{self.name} ORDER BY id LIMIT {processed}, {processed + batch_size}')['rows']
-                # logger.log(DEBUG,local_result)
-                remote_result = table.database.execute(f'SELECT * FROM {table.schema.name}.{table.name} ORDER BY id LIMIT {processed}, {processed + batch_size}')['rows']
-                for index in range(batch_size):
-                    if index < len(local_result) or index < len(remote_result):
-                        if column_names == "":
-                            for column in local_result[index].keys():
-                                column_names += f"{column},"
-                            column_names = column_names.strip(',')
-                        if index < len(local_result):
-                            local_row = local_result[index]
-                        else:
-                            local_row = None
-                        if index < len(remote_result):
-                            remote_row = local_result[index]
-                        else: remote_row = None
-                        if local_row is not None and remote_row is not None:
-                            if  local_row != remote_row:
-                                logger.debug("Difference catched")
-                                if print_to_console:
-                                    print(f'Conflict Local: {local_result[index]}')
-                                    print(f'Conflict Remote: {remote_result[index]}')
+            key = self.get_primary_key()
+            if not key:
+                logger.error(f"{self.fqn} has no primary key or unique index, can't compare by ranges")
+                return None
+            columns = list(self.get_columns().keys())
+            summary = new_compare_summary()
+            remote_writer, local_writer, streams = self.open_fix_writers(table, fix_script, fix, delete_extra, columns, key)
+            timer_start = monotonic()
+            upper = None
+            try:
+                for lower, upper in self.iter_chunks(batch_size, key):
+                    diff = self.compare_chunk(table, lower, upper, key, columns, algorithm)
+                    add_chunk_to_summary(summary, diff)
+                    if diff is None or not diff["different"]:
+                        continue
+                    if print_to_console:
+                        print_chunk_diff(diff, self.database.hostname, table.database.hostname)
+                    if remote_writer:
+                        write_chunk_fixes(diff, remote_writer, local_writer)
+                    if summary["chunks"] % 100 == 0:
+                        logger.log(INFO,f'{summary["chunks"]} chunks checked, {summary["chunks_different"]} different')
+            except mysql.connector.Error as err:
+                add_boundary_error(summary, self.fqn, upper, err)
+            finally:
+                self.close_fix_writers(summary, remote_writer, local_writer, streams)
+            summary["exec_time"] = monotonic() - timer_start
+            log_compare_summary(summary)
+            return summary
+        return None
+
+    def open_fix_writers(self, table, fix_script, fix, delete_extra, columns, key):
+        # FixScriptWriters for compare_data(_parallel). fix_script is True (stdout), a stream, or a
+        # path prefix for one <prefix>.<host>.<schema>.<table>.sql file per side.
+        # Returns (remote_writer, local_writer, [(stream, target) to close])
+        streams = []
+        if not fix_script and not fix:
+            return None, None, streams
+        def open_stream(side_table, spool):
+            if not fix_script:
+                return None
+            if isinstance(fix_script, str):
+                stream = open(f"{fix_script}.{side_table.database.hostname}.{side_table.fqn}.sql", 'w')
+                streams.append((stream, None))
+                return stream
+            target = sys.stdout if fix_script is True else fix_script
+            if not spool:
+                return target
+            # The second side is spooled to disk and appended after the first one on close
+            stream = TemporaryFile(mode='w+')
+            streams.append((stream, target))
+            return stream
+        remote_writer = FixScriptWriter(table, open_stream(table, False), apply=fix, columns=columns, key=key)
+        local_writer = None
+        if not delete_extra:
+            local_writer = FixScriptWriter(self, open_stream(self, True), apply=fix, columns=columns, key=key)
+        return remote_writer, local_writer, streams
+
+    def close_fix_writers(self, summary, remote_writer, local_writer, streams):
+        for side, writer in (('remote', remote_writer), ('local', local_writer)):
+            if writer is not None:
+                summary[f"{side}_fixes"] = writer.close()
+        for stream, target in streams:
+            if target is not None:
+                stream.seek(0)
+                copyfileobj(stream, target)
+            stream.close()
+
+    def compare_data_parallel(self, table, workers=4, batch_size=10000, fix_script_prefix=None, algorithm='crc32', print_to_console=False, fix=False, delete_extra=True):
+        # compare_data spread over a process pool: the coordinator walks the key ranges and
+        # workers, each with its own connections to both hosts, checksum and diff them. Results
+        # stream back as ranges finish and fixes go through FixScriptWriters (one
+        # <fix_script_prefix>.<host>.<schema>.<table>.sql per side) as they arrive, so memory
+        # stays bounded by the chunks in flight
+        if not (self.database.is_connected() and table.database.is_connected()):
+            return None
+        logger.log(INFO,f'Comparing {self.fqn} on {self.database.hostname} and {table.database.hostname} with {workers} workers')
+        key = self.get_primary_key()
+        if not key:
+            logger.error(f"{self.fqn} has no primary key or unique index, can't compare by ranges")
+            return None
+        columns = list(self.get_columns().keys())
+        summary = new_compare_summary()
+        remote_writer, local_writer, streams = self.open_fix_writers(table, fix_script_prefix, fix, delete_extra, columns, key)
+        timer_start = monotonic()
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_compare_worker, initargs=(table_spec(self), table_spec(table))) as executor:
+                pending = set()
+                chunks = self.iter_chunks(batch_size, key)
+                exhausted = False
+                upper = None
+                while pending or not exhausted:
+                    # Keep a couple of ranges queued per worker, never the whole table
+                    while not exhausted and len(pending) < workers * 2:
+                        try:
+                            chunk = next(chunks, None)
+                        except mysql.connector.Error as err:
+                            add_boundary_error(summary, self.fqn, upper, err)
+                            chunk = None
+                        if chunk is None:
+                            exhausted = True
                         else:
-                            if local_row is not None:
-                                if print_to_console:
-                                    print(f'local: {local_result[index]}')
-                                    print(f'Missing at {table.database.hostname}')
-                                if fix_script:
-                                    logger.debug('Adding line to remote script')
-                                    values = ""
-                                    for value in local_result[index].values():
-                                        if type(value) == 'datetime':
-                                            values += f"'{value.isoformat().split('.')[0].replace('T',' ')}',"
-                                        if type(value) == 'str':
-                                            values += f"{value},"
-                                        else:
-                                            values += f"{value},"
-                                    values = values.strip(",")
-                                    logger.debug(values)
-                                    remote_script += f"\nINSERT INTO {self.schema.name}.{self.name} ({column_names}) VALUES ({values});"
-                            if remote_row is not None:
-                                if print_to_console:
-                                    print(f'Missing at {self.database.hostname}')
-                                    print(f'remote: {remote_result[index]}')
-                                if fix_script:
-                                    logger.debug('Adding line to local script')
-                                    local_script += f"\nINSERT INTO {self.schema.name}.{self.name} ({remote_result[index].keys()}) VALUES ({remote_result[index].values()});"
-                    else:
+                            upper = chunk[1]
+                            pending.add(executor.submit(compare_chunk_worker, chunk[0], chunk[1], key, columns, algorithm))
+                    if not pending:
                         break
-                logger.log(INFO,f'{processed + index} of {local_rowcount} rows processed')
-                if processed % batch_size == 0 and processed != 0:
-                    processed += batch_size
-                else:
-                    processed += batch_size - 1
-            if fix_script:
-                local_script += '\ncommit;'
-                remote_script += '\ncommit;'
-                if local_script:
-                    print(f'Run on {self.database.hostname}:{local_script}')
-                if remote_script:
-                    print(f'Run on {table.database.hostname}:{remote_script}')
-        return None
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        diff = future.result()
+                        add_chunk_to_summary(summary, diff)
+                        if "error" in diff or not diff["different"]:
+                            continue
+                        if print_to_console:
+                            print_chunk_diff(diff, self.database.hostname, table.database.hostname)
+                        if remote_writer:
+                            write_chunk_fixes(diff, remote_writer, local_writer)
+                    if summary["chunks"] % 100 < len(done):
+                        logger.log(INFO,f'{summary["chunks"]} chunks checked, {summary["chunks_different"]} different')
+        finally:
+            self.close_fix_writers(summary, remote_writer, local_writer, streams)
+        summary["exec_time"] = monotonic() - timer_start
+        log_compare_summary(summary)
+        return summary
 
 
 class User:
     def __init__(self, database: Database, username, host = '%', password = None):
-        result = database.execute(command=f"SELECT * FROM mysql.user WHERE user = '{username}' and host = '{host}';")
+        result = database.execute(command="SELECT * FROM mysql.user WHERE user = %s and host = %s", params=(username, host))
         self.database = database
         self.roles = []
         self.grants = []
@@ -653,7 +2333,7 @@ class User:
         }
 
     def check(self):
-        response = self.database.execute(f"SELECT user, host FROM mysql.user WHERE user = '{self.username}' AND host = '{self.host}'")
+        response = self.database.execute("SELECT user, host FROM mysql.user WHERE user = %s AND host = %s", params=(self.username, self.host))
         if response["rowcount"] == 1:
             self.exists = True
 
@@ -724,6 +2404,288 @@ class User:
             self.create()
 
 # Methods
+# Schema diff
+# Order of the ALTER TABLE clauses generated for one table, so dependent changes apply cleanly
+ALTER_ORDER = ('DROP FOREIGN KEY', 'DROP INDEX', 'ADD COLUMN', 'MODIFY COLUMN', 'DROP COLUMN', 'ADD INDEX', 'ADD CONSTRAINT')
+NUMERIC_TYPES = ('tinyint', 'smallint', 'mediumint', 'int', 'bigint', 'decimal', 'float', 'double', 'bit', 'year')
+
+def definition_hash(definition):
+    return sha1(json.dumps(definition, sort_keys=True, default=str).encode()).hexdigest()
+
+def column_fingerprint(column):
+    # Column position is not part of the definition, reordering alone is not drift
+    return definition_hash({key: value for key, value in column.items() if key != 'ordinal_position'})
+
+def column_definition(name, column):
+    definition = f"{name} {column['column_type']}"
+    if column.get('collation'):
+        definition += f" COLLATE {column['collation']}"
+    definition += ' NOT NULL' if column['is_nullable'] == 'NO' else ' NULL'
+    default = column['column_default']
+    if default is not None:
+        if column['data_type'] in NUMERIC_TYPES or default.upper().startswith('CURRENT_TIMESTAMP') or default.upper() == 'NULL':
+            definition += f" DEFAULT {default}"
+        else:
+            definition += f" DEFAULT '{default.replace(chr(39), chr(39) * 2)}'"
+    extra = (column.get('extra') or '').replace('DEFAULT_GENERATED', '').strip()
+    if extra:
+        definition += f" {extra}"
+    return definition
+
+def index_definition(name, index):
+    columns = ','.join(index['columns'])
+    if name == 'PRIMARY':
+        return f"PRIMARY KEY ({columns})"
+    if index['index_type'] in ('FULLTEXT', 'SPATIAL'):
+        return f"{index['index_type']} INDEX {name} ({columns})"
+    if index['non_unique'] == 0:
+        return f"UNIQUE INDEX {name} ({columns})"
+    return f"INDEX {name} ({columns})"
+
+def foreign_key_definition(name, constraint):
+    return f"CONSTRAINT {name} FOREIGN KEY ({','.join(constraint['columns'])}) REFERENCES {constraint['referenced_table']} ({','.join(constraint['referenced_columns'])})"
+
+def create_table_statement(table_name, table):
+    clauses = [column_definition(column, attributes) for column, attributes in sorted(table['columns'].items(), key=lambda item: item[1]['ordinal_position'])]
+    clauses += [index_definition(name, index) for name, index in sorted(table.get('indexes', {}).items(), key=lambda item: item[0] != 'PRIMARY')]
+    clauses += [foreign_key_definition(name, constraint) for name, constraint in sorted(table.get('constraints', {}).items()) if constraint['constraint_type'] == 'FOREIGN KEY']
+    return f"CREATE TABLE {table_name} (\n  " + ",\n  ".join(clauses) + "\n);"
+
+def routine_statement(routine_name, routine):
+    # Body contains semicolons, so the statement carries its own DELIMITER lines
+    header = f"CREATE {routine['routine_type']} {routine_name}({', '.join(routine['parameters'])})"
+    if routine['routine_type'] == 'FUNCTION':
+        header += f" RETURNS {routine['returns']}"
+    if routine['is_deterministic'] == 'YES':
+        header += " DETERMINISTIC"
+    header += f" {routine['sql_data_access']} SQL SECURITY {routine['security_type']}"
+    return f"DROP {routine['routine_type']} IF EXISTS {routine_name};\nDELIMITER ;;\n{header}\n{routine['routine_definition']};;\nDELIMITER ;"
+
+def compare_items(local_items, remote_items, fingerprint_function=definition_hash):
+    # Splits two {name: definition} dicts into sorted added (local only), dropped (remote only)
+    # and modified names, comparing fingerprints instead of walking the definitions
+    added = sorted(name for name in local_items if name not in remote_items)
+    dropped = sorted(name for name in remote_items if name not in local_items)
+    modified = sorted(name for name in local_items if name in remote_items and fingerprint_function(local_items[name]) != fingerprint_function(remote_items[name]))
+    return added, dropped, modified
+
+def table_fingerprint(table):
+    # Hash of everything compare_tables looks at, equal fingerprints mean no drift
+    return definition_hash({
+        'columns': {column: column_fingerprint(attributes) for column, attributes in table['columns'].items()},
+        'indexes': table.get('indexes', {}),
+        'constraints': table.get('constraints', {})
+    })
+
+def compare_tables(local_tables, remote_tables, local_host, remote_host, schema_name, local_routines=None, remote_routines=None, allow_drops=False):
+    # Bidirectional diff of two {table_name: table} dicts (see Schema.get_tables) and optionally
+    # of two {routine_name: routine} dicts (see Database.load_routines). Tables with equal
+    # fingerprints are skipped. Fix commands bring the remote side in line with the local one,
+    # DROP commands are only generated with allow_drops=True
+    diff_dict = {
+        'differences': [],
+        'fix_commands': []
+    }
+
+    def difference(object_type, table_name, name, change, local_value, remote_value):
+        diff_dict['differences'].append({
+            'schema': schema_name,
+            'object': object_type,
+            'table': table_name,
+            'name': name,
+            'change': change,
+            'values': {
+                local_host: local_value,
+                remote_host: remote_value
+            }
+        })
+
+    added, dropped, modified = compare_items(local_tables, remote_tables, table_fingerprint)
+    for table_name in added:
+        difference('table', table_name, table_name, 'added', {'table_exists': True}, {'table_exists': False})
+        # Views have no column DDL to rebuild them from, they are only reported
+        if local_tables[table_name].get('table_type') != 'VIEW':
+            diff_dict['fix_commands'].append(create_table_statement(table_name, local_tables[table_name]))
+    for table_name in modified:
+        local_table = local_tables[table_name]
+        remote_table = remote_tables[table_name]
+        logger.log(DEBUG, f"Checking table {table_name}")
+        clauses = {clause: [] for clause in ALTER_ORDER}
+        columns_added, columns_dropped, columns_modified = compare_items(local_table['columns'], remote_table['columns'], column_fingerprint)
+        for column in columns_added:
+            difference('column', table_name, column, 'added', {'column_exists': True}, {'column_exists': False})
+            clauses['ADD COLUMN'].append(f"ADD COLUMN {column_definition(column, local_table['columns'][column])}")
+        for column in columns_dropped:
+            difference('column', table_name, column, 'dropped', {'column_exists': False}, {'column_exists': True})
+            if allow_drops:
+                clauses['DROP COLUMN'].append(f"DROP COLUMN {column}")
+        for column in columns_modified:
+            local_column = local_table['columns'][column]
+            remote_column = remote_table['columns'][column]
+            keys = sorted(key for key in local_column if key != 'ordinal_position' and local_column[key] != remote_column.get(key))
+            difference('column', table_name, column, 'modified', {key: local_column[key] for key in keys}, {key: remote_column.get(key) for key in keys})
+            clauses['MODIFY COLUMN'].append(f"MODIFY COLUMN {column_definition(column, local_column)}")
+        local_indexes = local_table.get('indexes', {})
+        remote_indexes = remote_table.get('indexes', {})
+        indexes_added, indexes_dropped, indexes_modified = compare_items(local_indexes, remote_indexes)
+        for index in indexes_added + indexes_modified:
+            difference('index', table_name, index, 'added' if index in indexes_added else 'modified', local_indexes[index], remote_indexes.get(index))
+            if index in indexes_modified:
+                clauses['DROP INDEX'].append('DROP PRIMARY KEY' if index == 'PRIMARY' else f"DROP INDEX {index}")
+            clauses['ADD INDEX'].append(f"ADD {index_definition(index, local_indexes[index])}")
+        for index in indexes_dropped:
+            difference('index', table_name, index, 'dropped', None, remote_indexes[index])
+            if allow_drops:
+                clauses['DROP INDEX'].append('DROP PRIMARY KEY' if index == 'PRIMARY' else f"DROP INDEX {index}")
+        # Primary and unique keys are covered by the indexes, foreign keys are fixed here
+        local_constraints = {name: constraint for name, constraint in local_table.get('constraints', {}).items() if constraint['constraint_type'] not in ('PRIMARY KEY', 'UNIQUE')}
+        remote_constraints = {name: constraint for name, constraint in remote_table.get('constraints', {}).items() if constraint['constraint_type'] not in ('PRIMARY KEY', 'UNIQUE')}
+        constraints_added, constraints_dropped, constraints_modified = compare_items(local_constraints, remote_constraints)
+        for constraint in constraints_added + constraints_modified:
+            difference('constraint', table_name, constraint, 'added' if constraint in constraints_added else 'modified', local_constraints[constraint], remote_constraints.get(constraint))
+            if local_constraints[constraint]['constraint_type'] == 'FOREIGN KEY':
+                if constraint in constraints_modified:
+                    clauses['DROP FOREIGN KEY'].append(f"DROP FOREIGN KEY {constraint}")
+                clauses['ADD CONSTRAINT'].append(f"ADD {foreign_key_definition(constraint, local_constraints[constraint])}")
+        for constraint in constraints_dropped:
+            difference('constraint', table_name, constraint, 'dropped', None, remote_constraints[constraint])
+            if allow_drops and remote_constraints[constraint]['constraint_type'] == 'FOREIGN KEY':
+                clauses['DROP FOREIGN KEY'].append(f"DROP FOREIGN KEY {constraint}")
+        alter = [clause for clause_type in ALTER_ORDER for clause in clauses[clause_type]]
+        if alter:
+            diff_dict['fix_commands'].append(f"ALTER TABLE {table_name} " + ", ".join(alter) + ";")
+    for table_name in dropped:
+        difference('table', table_name, table_name, 'dropped', {'table_exists': False}, {'table_exists': True})
+        if allow_drops:
+            diff_dict['fix_commands'].append(f"DROP {'VIEW' if remote_tables[table_name].get('table_type') == 'VIEW' else 'TABLE'} {table_name};")
+    if local_routines is not None and remote_routines is not None:
+        added, dropped, modified = compare_items(local_routines, remote_routines)
+        for routine_name in added + modified:
+            difference('routine', None, routine_name, 'added' if routine_name in added else 'modified', local_routines[routine_name], remote_routines.get(routine_name))
+            diff_dict['fix_commands'].append(routine_statement(routine_name, local_routines[routine_name]))
+        for routine_name in dropped:
+            difference('routine', None, routine_name, 'dropped', None, remote_routines[routine_name])
+            if allow_drops:
+                diff_dict['fix_commands'].append(f"DROP {remote_routines[routine_name]['routine_type']} IF EXISTS {routine_name};")
+    return diff_dict
+
+# Schemas never compared by the fleet drift engine
+SYSTEM_SCHEMAS = ('mysql', 'information_schema', 'performance_schema', 'sys')
+
+
+def compare_fleet(reference, replicas, schema_names=None, max_workers=16, cache=None, exclude=SYSTEM_SCHEMAS, allow_drops=False):
+    # Compares every schema of the reference Database against each replica Database.
+    # Metadata is loaded from all hosts concurrently, tables with equal fingerprints are skipped
+    # and each distinct (reference, replica) table pair is diffed only once for the whole fleet.
+    # Returns the consolidated differences per host/schema and a fix script per host
+    timer_start = monotonic()
+    if schema_names is None:
+        schema_names = [row['schema_name'] for row in reference.get_schemas() if row['schema_name'].lower() not in exclude]
+
+    def load(database):
+        # A replica whose catalog can't be read is reported, not compared against a partial one
+        try:
+            existing = {row['schema_name'] for row in database.get_schemas()}
+            if cache is None:
+                tables = database.load_metadata(schema_names)
+            else:
+                tables = {schema_name: cache.get_tables(database, schema_name) for schema_name in schema_names}
+            return tables, database.load_routines(schema_names), existing, None
+        except (mysql.connector.Error, KeyError, TypeError) as err:
+            logger.error(f"Unable to load the metadata of {database.hostname}:{database.port}: {err}")
+            return None, None, None, str(err) or type(err).__name__
+
+    databases = [reference] + list(replicas)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        metadata, routines, schemas, errors = zip(*executor.map(load, databases))
+    if errors[0] is not None:
+        raise InterfaceError(msg=f"Unable to load the metadata of the reference {reference.hostname}:{reference.port}: {errors[0]}")
+    fingerprints = [{schema_name: {table_name: table_fingerprint(table) for table_name, table in tables.items()} for schema_name, tables in host_metadata.items()} if host_metadata is not None else None for host_metadata in metadata]
+    labels = ('<reference>', '<replica>')
+
+    result = {
+        'differences': {},
+        'fix_scripts': {},
+        'errors': {},
+        'summary': {
+            'hosts': len(replicas),
+            'schemas': len(schema_names),
+            'tables_compared': 0,
+            'tables_skipped': 0,
+            'tables_with_drift': 0
+        }
+    }
+    pair_cache = {}
+    for index, replica in enumerate(replicas, start=1):
+        host = f"{replica.hostname}:{replica.port}"
+        if errors[index] is not None:
+            result['errors'][host] = errors[index]
+            continue
+        host_differences = {}
+        fix_script = []
+        for schema_name in schema_names:
+            if schema_name not in schemas[index]:
+                host_differences[schema_name] = [{'schema': schema_name, 'object': 'schema', 'table': None, 'name': schema_name, 'change': 'added', 'values': {reference.hostname: {'schema_exists': True}, replica.hostname: {'schema_exists': False}}}]
+                continue
+            differences = []
+            fix_commands = []
+            reference_tables = fingerprints[0][schema_name]
+            replica_tables = fingerprints[index][schema_name]
+            for table_name in sorted(set(reference_tables) | set(replica_tables)):
+                table_hash = reference_tables.get(table_name)
+                replica_hash = replica_tables.get(table_name)
+                if replica_hash == table_hash:
+                    result['summary']['tables_skipped'] += 1
+                    continue
+                result['summary']['tables_compared'] += 1
+                key = (schema_name, table_name, table_hash, replica_hash)
+                if key not in pair_cache:
+                    local_tables = {table_name: metadata[0][schema_name][table_name]} if table_hash else {}
+                    remote_tables = {table_name: metadata[index][schema_name][table_name]} if replica_hash else {}
+                    pair_cache[key] = compare_tables(local_tables, remote_tables, *labels, schema_name, allow_drops=allow_drops)
+                diff = pair_cache[key]
+                if diff['differences']:
+                    result['summary']['tables_with_drift'] += 1
+                differences += diff['differences']
+                fix_commands += diff['fix_commands']
+            if definition_hash(routines[0][schema_name]) != definition_hash(routines[index][schema_name]):
+                diff = compare_tables({}, {}, *labels, schema_name, routines[0][schema_name], routines[index][schema_name], allow_drops=allow_drops)
+                differences += diff['differences']
+                fix_commands += diff['fix_commands']
+            if differences:
+                host_differences[schema_name] = relabel(differences, {labels[0]: reference.hostname, labels[1]: replica.hostname})
+            if fix_commands:
+                # New tables first so later ALTERs and routines can reference them, drops last
+                fix_commands.sort(key=lambda command: 0 if command.startswith('CREATE TABLE') else 2 if command.startswith(('DROP TABLE', 'DROP VIEW')) else 1)
+                fix_script += [f"USE {schema_name};"] + fix_commands
+        if host_differences:
+            result['differences'][host] = host_differences
+        if fix_script:
+            result['fix_scripts'][host] = fix_script
+    result['summary']['exec_time'] = monotonic() - timer_start
+    result['summary']['hosts_failed'] = len(result['errors'])
+    logger.info(f"Fleet drift: {len(result['differences'])} of {len(replicas)} hosts drifted, {len(result['errors'])} failed, {result['summary']['tables_with_drift']} tables with drift, {result['summary']['tables_skipped']} identical tables skipped in {result['summary']['exec_time']:.1f} s")
+    return result
+
+def relabel(item, labels):
+    # Copy of a nested dict/list structure with the dict keys found in labels renamed
+    if isinstance(item, dict):
+        return {labels.get(key, key): relabel(value, labels) for key, value in item.items()}
+    if isinstance(item, list):
+        return [relabel(value, labels) for value in item]
+    return item
+
+def write_fix_scripts(result, directory):
+    # One <host>_<port>.sql per drifted host from a compare_fleet() result. Returns the paths written
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for host, commands in result['fix_scripts'].items():
+        path = os.path.join(directory, f"{host.replace(':', '_')}.sql")
+        with open(path, 'w') as script:
+            script.write("\n".join(commands) + "\n")
+        paths.append(path)
+    return paths
+
 def list_to_sql(items):
     result = ""
     for item in items:
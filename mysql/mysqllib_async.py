@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+mysqllib_async.py:
+  asyncio flavour of mysqllib, so many databases can be worked on concurrently
+  from a single event loop. Blocking driver calls are bridged to a thread pool
+  and bounded by an asyncio connection pool.
+
+Requirements:
+  - Python 3.7+
+  - mysql-connector-python
+  - mysqllib
+"""
+
+__version__     = "1.0"
+__author__      = "Jesus Alejandro Sanchez Davila"
+__maintainer__  = "Jesus Alejandro Sanchez Davila"
+__email__       = "jsanchez.consultant@gmail.com"
+__status__      = "Alpha"
+
+import mysqllib
+import mysql.connector
+from mysql.connector.errors import InterfaceError
+from mysql.connector.errors import OperationalError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from contextlib import asynccontextmanager
+from functools import partial
+import asyncio
+import logging
+from logging import CRITICAL
+from logging import ERROR
+from logging import WARNING
+
+logger = logging.getLogger()
+
+# Pool connections a single compare_data call holds at once on each side: the row hash
+# stream, the row fetch for differing keys and the FixScriptWriter applying the fixes
+COMPARE_CONNECTIONS = 3
+
+# Async connection pool class
+class AsyncConnectionPool:
+    def __init__(self, pool, executor):
+        # pool is a mysqllib.ConnectionPool. Coroutines reserve as many of its connections as the
+        # blocking call they run will hold (see slots), so no thread ever blocks on the pool
+        self.pool = pool
+        self.executor = executor
+        self.available = pool.size
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slots(self, count=1):
+        # All count slots are taken at once, partial reservations could deadlock each other
+        count = min(count, self.pool.size)
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.available >= count)
+            self.available -= count
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.available += count
+                self.condition.notify_all()
+
+    async def run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self.slots(1):
+            pooled = await self.run(self.pool.acquire)
+            try:
+                yield pooled
+            except (InterfaceError, OperationalError):
+                await self.run(self.pool.release, pooled, discard=True)
+                raise
+            except BaseException:
+                await self.run(self.pool.release, pooled)
+                raise
+            else:
+                await self.run(self.pool.release, pooled)
+
+    async def close(self):
+        await self.run(self.pool.close)
+
+    def statistics(self):
+        return self.pool.statistics()
+
+# Async Database class
+class AsyncDatabase:
+    # Attributes
+    pool = None
+
+    # Creator
+    def __init__(self, hostname, port=3306, database='information_schema', log_level=logging.INFO, executor=None):
+        # The synchronous Database holds the credentials, metrics and statement logic
+        self.database = mysqllib.Database(hostname=hostname, port=port, database=database, log_level=log_level)
+        self.hostname = hostname
+        self.port = port
+        self.executor = executor
+        self.own_executor = executor is None
+
+    # Methods
+    async def connect(self, username, password, schema='', auth_plugin=None, nolog=False, pool_size=5, stale_after=60, statement_cache_size=64, allow_local_infile=False):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=pool_size * 2, thread_name_prefix=f"mysqllib-{self.hostname}")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, partial(self.database.connect, username=username, password=password, schema=schema, auth_plugin=auth_plugin, nolog=nolog, pool_size=pool_size, stale_after=stale_after, statement_cache_size=statement_cache_size, allow_local_infile=allow_local_infile))
+        if self.database.is_connected():
+            self.pool = AsyncConnectionPool(self.database.pool, self.executor)
+
+    async def disconnect(self):
+        if self.pool:
+            await self.run_sync(self.database.disconnect)
+            self.pool = None
+        if self.own_executor and self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def is_connected(self):
+        return self.pool is not None
+
+    async def run_sync(self, func, *args, connections=1, **kwargs):
+        # Runs any blocking mysqllib call (Schema, Table, User helpers) in the thread pool.
+        # connections: pool connections func holds at the same time
+        loop = asyncio.get_running_loop()
+        if self.pool:
+            async with self.pool.slots(connections):
+                return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    async def execute(self, command, params=None, result_format='dict', numpy_arrays=False, commit=False):
+        resultset = {}
+        if self.is_connected():
+            try:
+                async with self.pool.connection() as pooled:
+                    resultset = await self.pool.run(self.database.execute_on, pooled, command, params=params, result_format=result_format, numpy_arrays=numpy_arrays, commit=commit)
+            except mysql.connector.Error as err:
+                logger.log(WARNING, 'Catched exception while executing')
+                logger.log(CRITICAL, err.errno)
+                logger.log(CRITICAL, err.sqlstate)
+                logger.log(CRITICAL, err.msg)
+            except Exception as e:
+                logger.log(WARNING, 'Catched exception while executing')
+                logger.log(CRITICAL, e)
+            return resultset
+        else:
+            logger.log(ERROR, 'Please connect first, then try again')
+
+    ## Schema methods
+    async def get_schemas(self):
+        return (await self.execute('SELECT schema_name, default_character_set_name AS charset, default_collation_name as collation FROM information_schema.schemata'))['rows']
+
+    async def get_schema(self, schema_name):
+        return await self.run_sync(self.database.get_schema, schema_name)
+
+    ## User Methods
+    async def get_user_by_name(self, username):
+        return await self.run_sync(self.database.get_user_by_name, username)
+
+    async def get_user_by_name_host(self, username, host):
+        return await self.run_sync(self.database.get_user_by_name_host, username, host)
+
+    async def get_version(self):
+        return await self.run_sync(self.database.get_version)
+
+    async def flush_privileges(self):
+        return await self.execute(command="FLUSH PRIVILEGES")
+
+    def get_metrics(self, output_format='dict'):
+        return self.database.get_metrics(output_format)
+
+    def pool_statistics(self):
+        return self.database.pool_statistics()
+
+# Async Schema class
+class AsyncSchema:
+    def __init__(self, database, schema):
+        # Use AsyncSchema.create(), the constructor needs an already loaded mysqllib.Schema
+        self.database = database
+        self.schema = schema
+        self.name = schema.name
+
+    @classmethod
+    async def create(cls, database, name):
+        schema = await database.run_sync(mysqllib.Schema, database.database, name)
+        return cls(database, schema)
+
+    @property
+    def tables(self):
+        return self.schema.tables
+
+    async def load_tables(self, cache=None):
+        await self.database.run_sync(self.schema.load_tables, cache)
+
+    async def get_tables(self):
+        return await self.database.run_sync(self.schema.get_tables)
+
+    async def get_table(self, table_name):
+        return await self.database.run_sync(self.schema.get_table, table_name)
+
+    async def compare(self, schema, gen_fix_script=False, cache=None, allow_drops=False):
+        return await self.database.run_sync(self.schema.compare, schema.schema, gen_fix_script=gen_fix_script, cache=cache, allow_drops=allow_drops)
+
+# Async Table class
+class AsyncTable:
+    def __init__(self, schema, name):
+        self.schema = schema
+        self.database = schema.database
+        self.table = mysqllib.Table(schema=schema.schema, name=name)
+        self.name = name
+        self.fqn = self.table.fqn
+
+    async def get_columns(self):
+        return await self.database.run_sync(self.table.get_columns)
+
+    async def get_rowcount(self, estimate=False):
+        return await self.database.run_sync(self.table.get_rowcount, estimate)
+
+    async def delete(self, rows: list, batch_size = 1, delay = 0):
+        return await self.database.run_sync(self.table.delete, rows, batch_size=batch_size, delay=delay)
+
+    async def bulk_insert(self, rows, columns: list = None, batch_rows=1000, batch_bytes=None, batches_per_transaction=1, load_data=False):
+        return await self.database.run_sync(self.table.bulk_insert, rows, columns=columns, batch_rows=batch_rows, batch_bytes=batch_bytes, batches_per_transaction=batches_per_transaction, load_data=load_data)
+
+    async def compare_data(self, table, batch_size=10000, print_to_console=False, fix_script=False, fix=False, algorithm='crc32', delete_extra=True):
+        # Connections are used on both databases, they are reserved in a fixed order so two
+        # compares running in opposite directions can't each hold one side
+        claims = {}
+        for database in (self.database, table.database):
+            if database.pool:
+                pool, count = claims.get(id(database.pool), (database.pool, 0))
+                claims[id(database.pool)] = (pool, count + COMPARE_CONNECTIONS)
+        async with AsyncExitStack() as stack:
+            for pool_id in sorted(claims):
+                pool, count = claims[pool_id]
+                await stack.enter_async_context(pool.slots(count))
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.database.executor, partial(self.table.compare_data, table.table, batch_size=batch_size, print_to_console=print_to_console, fix_script=fix_script, fix=fix, algorithm=algorithm, delete_extra=delete_extra))
+
+# Methods
+async def for_each_host(hosts, coroutine_function, concurrency=20):
+    # Runs coroutine_function(host) for every host with at most `concurrency` in flight.
+    # Returns {host: result}, exceptions are logged and returned as the host's result
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(host):
+        async with semaphore:
+            try:
+                return host, await coroutine_function(host)
+            except Exception as err:
+                logger.error(f"{host}: {err}")
+                return host, err
+
+    return dict(await asyncio.gather(*(run(host) for host in hosts)))
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+mysqllib_benchmark.py:
+  Script for benchmarking mysqllib features against a live MySQL database
+
+Requirements:
+  - Python 3
+  - mysql-connector-python
+  - numpy (optional)
+"""
+
+__version__     = "1.0"
+__author__      = "Jesus Alejandro Sanchez Davila"
+__maintainer__  = "Jesus Alejandro Sanchez Davila"
+__email__       = "jsanchez.consultant@gmail.com"
+__status__      = "Alpha"
+
+import mysqllib
+from argparse import ArgumentParser
+from getpass import getpass
+from time import perf_counter
+import json
+import logging
+import os
+import sys
+import tracemalloc
+
+# Add current path
+path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if not path in sys.path:
+  sys.path.insert(1, path)
+del path
+
+# Argument Parser
+parser = ArgumentParser()
+parser.add_argument('-d', '--database', dest='dbHost', required=True, help='Database to connect to')
+parser.add_argument('-P', '--port', dest='dbPort', default=3306, help='Port to connect to the database')
+parser.add_argument('-u', '--user', dest='dbUser', required=True, help='Username to connect to the database')
+parser.add_argument('-p', '--password', dest='askForPassword', action='store_true', help='Ask for the password')
+parser.add_argument('-q', '--query', dest='query', default='SELECT * FROM information_schema.columns', help='Query to benchmark')
+parser.add_argument('-s', '--schema', dest='schemas', action='append', help='Schema to benchmark metadata loading on (can be repeated)')
+parser.add_argument('-n', '--iterations', dest='iterations', type=int, default=5, help='Runs per result format')
+
+# Benchmarks
+def legacy_execute(db, query):
+    # Baseline: the conversion execute() used before result formats, a dictionary cursor
+    # whose rows were copied column by column into new dicts
+    with db.pool.connection() as pooled:
+        cursor = pooled.cnx.cursor(buffered=True, dictionary=True)
+        cursor.execute(query)
+        resultset = {
+            'rows': []
+        }
+        rows = cursor.fetchall()
+        columns = cursor.column_names
+        for row in rows:
+            row_dic = {}
+            for column in columns:
+                row_dic[column] = row[column]
+            resultset['rows'].append(row_dic)
+        resultset["rowcount"] = cursor.rowcount
+        cursor.close()
+    return resultset
+
+def bench_result_formats(db, query, iterations):
+    results = {}
+    cases = [('legacy_dict', lambda: legacy_execute(db, query))]
+    for result_format, numpy_arrays in [('dict', False), ('tuple', False), ('columnar', False), ('columnar', True)]:
+        if numpy_arrays and mysqllib.numpy is None:
+            continue
+        label = f"{result_format}{'+numpy' if numpy_arrays else ''}"
+        cases.append((label, lambda result_format=result_format, numpy_arrays=numpy_arrays: db.execute(query, result_format=result_format, numpy_arrays=numpy_arrays)))
+    for label, func in cases:
+        timings = []
+        for i in range(iterations):
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+        # Separate run for memory, tracemalloc slows everything down
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[label] = {
+            "best_s": min(timings),
+            "avg_s": sum(timings) / len(timings),
+            "peak_memory_kb": peak // 1024
+        }
+    return results
+
+def bench_metadata(db, schema_names, iterations):
+    # Per-table information_schema lookups against the set-based loader
+    results = {}
+    schemas = [mysqllib.Schema(db, schema_name) for schema_name in schema_names]
+    def per_table():
+        for schema in schemas:
+            for table_name in db.execute("SELECT table_name AS table_name FROM information_schema.tables WHERE table_schema = %s", params=(schema.name,))['rows']:
+                mysqllib.Table(schema, table_name['table_name']).get_columns()
+    def per_schema():
+        for schema in schemas:
+            schema.get_tables()
+    def bulk():
+        db.load_metadata(schema_names)
+    for label, func in [('per_table', per_table), ('per_schema', per_schema), ('bulk', bulk)]:
+        timings = []
+        for i in range(iterations):
+            start = perf_counter()
+            func()
+            timings.append(perf_counter() - start)
+        results[label] = {
+            "best_s": min(timings),
+            "avg_s": sum(timings) / len(timings)
+        }
+    results["tables"] = sum(len(tables) for tables in db.load_metadata(schema_names).values())
+    return results
+
+# Main algorythm
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    dbPswd = 'admin'
+    if args.askForPassword:
+        dbPswd = getpass(prompt='Please enter the password: ')
+
+    db = mysqllib.Database(hostname=args.dbHost, port=args.dbPort, log_level=logging.WARNING)
+    db.connect(username=args.dbUser, password=dbPswd)
+    report = {
+        "result_formats": bench_result_formats(db, args.query, args.iterations)
+    }
+    if args.schemas:
+        report["metadata"] = bench_metadata(db, args.schemas, args.iterations)
+    print(json.dumps(report, indent=2))
+    db.disconnect()
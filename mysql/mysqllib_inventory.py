@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+mysqllib_inventory.py:
+  Target inventory shared by the mysql scripts. Loads JSON, YAML and plain-text target
+  files into one deduplicated list, resolves hostnames concurrently through a TTL'd
+  DNS cache and indexes targets by tag (env, role, shard...) for fast selection.
+
+Requirements:
+  - Python 3
+  - PyYAML (optional, only for YAML files)
+"""
+
+__version__     = "1.0"
+__author__      = "Jesus Alejandro Sanchez Davila"
+__maintainer__  = "Jesus Alejandro Sanchez Davila"
+__email__       = "jsanchez.consultant@gmail.com"
+__status__      = "Alpha"
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+import json
+import logging
+import os
+import socket
+from logging import DEBUG
+from logging import WARNING
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+logger = logging.getLogger()
+
+FILE_TYPES = {
+    '.json': 'json',
+    '.yaml': 'yaml',
+    '.yml': 'yaml'
+}
+
+# DNS cache class
+class DnsCache:
+    # Addresses by hostname for ttl seconds, failed lookups are remembered too so a dead name
+    # in a big inventory doesn't cost a resolver timeout on every load
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.lock = Lock()
+        self.addresses = {}
+
+    def resolve(self, hostname):
+        with self.lock:
+            cached = self.addresses.get(hostname)
+        if cached is not None and monotonic() - cached[1] < self.ttl:
+            return cached[0]
+        try:
+            address = socket.getaddrinfo(hostname, None, proto=socket.IPPROTO_TCP)[0][4][0]
+        except (socket.gaierror, UnicodeError) as err:
+            logger.log(DEBUG, f'Unable to resolve {hostname}: {err}')
+            address = None
+        with self.lock:
+            self.addresses[hostname] = (address, monotonic())
+        return address
+
+    def clear(self):
+        with self.lock:
+            self.addresses = {}
+
+dns_cache = DnsCache()
+
+# Methods
+def parse_port(port, default_port=3306):
+    if port is None or port == '':
+        return default_port
+    port = int(port)
+    if not 0 < port < 65536:
+        raise ValueError(f'{port} is not a valid port')
+    return port
+
+def parse_target(text, default_port=3306):
+    # "host", "host:port" and "host:port key=value key=value" (plain text files, command line)
+    words = text.split()
+    host, _, port = words[0].partition(':')
+    tags = {}
+    for word in words[1:]:
+        key, _, value = word.partition('=')
+        tags[key] = value
+    return host, parse_port(port, default_port), tags
+
+# Inventory class
+class Inventory:
+    # Targets are dicts with host, port, tags and address (once resolved), unique by host:port.
+    # Callers connect to host (TLS hostname checks and host name grants need the name), address
+    # lets them skip names that don't resolve and is only connected to when asked for.
+    # index holds {tag: {value: set of host:port keys}} so select() is a set intersection
+    def __init__(self, default_port=3306, dns=None):
+        self.default_port = default_port
+        self.dns = dns if dns is not None else dns_cache
+        self.targets = {}
+        self.index = {}
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __iter__(self):
+        return iter(self.targets.values())
+
+    def key(self, host, port):
+        return f'{host.lower()}:{port}'
+
+    def add(self, host, port=None, **tags):
+        # Adding a known host:port merges its tags, returns the target
+        host = host.strip()
+        if not host:
+            raise ValueError('Empty hostname')
+        port = parse_port(port, self.default_port)
+        key = self.key(host, port)
+        target = self.targets.get(key)
+        if target is None:
+            target = {'host': host, 'port': port, 'tags': {}, 'address': None}
+            self.targets[key] = target
+        for tag, value in tags.items():
+            value = str(value)
+            old = target['tags'].get(tag)
+            if old is not None and old != value:
+                self.index[tag][old].discard(key)
+            target['tags'][tag] = value
+            self.index.setdefault(tag, {}).setdefault(value, set()).add(key)
+        return target
+
+    def remove(self, host, port=None):
+        key = self.key(host, parse_port(port, self.default_port))
+        target = self.targets.pop(key, None)
+        if target is not None:
+            for tag, value in target['tags'].items():
+                self.index[tag][value].discard(key)
+        return target
+
+    def clear(self):
+        self.targets = {}
+        self.index = {}
+
+    def select(self, **tags):
+        # select(env='prd', role='replica', shard=3), a list or set of values matches any of them
+        keys = None
+        for tag, values in tags.items():
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            matches = set()
+            for value in values:
+                matches |= self.index.get(tag, {}).get(str(value), set())
+            keys = matches if keys is None else keys & matches
+            if not keys:
+                return []
+        if keys is None:
+            return list(self.targets.values())
+        return [self.targets[key] for key in sorted(keys)]
+
+    ## Loading methods
+    def add_entry(self, entry, tags=None):
+        # One entry of a JSON/YAML document: "host[:port]" or {"host": .., "port": .., "tags": {..}}.
+        # Keys other than host/hostname/port/tags are taken as tags as well
+        tags = dict(tags or {})
+        if isinstance(entry, str):
+            host, port, entry_tags = parse_target(entry, self.default_port)
+            tags.update(entry_tags)
+            return self.add(host, port, **tags)
+        entry = dict(entry)
+        host = entry.pop('host', None) or entry.pop('hostname', None)
+        port = entry.pop('port', None)
+        tags.update(entry.pop('tags', None) or {})
+        tags.update(entry)
+        if host is None:
+            raise ValueError(f'No host in {entry}')
+        return self.add(host, port, **tags)
+
+    def add_document(self, document, tags=None):
+        # Accepts {host: port}, {host: {port: .., tag: ..}}, [entries] and {"targets": [entries], ...}
+        # where the other top-level keys of the last form are tags shared by all its targets
+        added = 0
+        if isinstance(document, dict) and isinstance(document.get('targets'), list):
+            shared = dict(tags or {})
+            shared.update({key: value for key, value in document.items() if key != 'targets' and not isinstance(value, (dict, list))})
+            return self.add_document(document['targets'], shared)
+        if isinstance(document, dict):
+            items = [dict(value, host=host) if isinstance(value, dict) else {'host': host, 'port': value} for host, value in document.items()]
+        else:
+            items = document
+        for entry in items:
+            try:
+                self.add_entry(entry, tags)
+                added += 1
+            except (ValueError, TypeError) as err:
+                logger.log(WARNING, f'Skipping target {entry}: {err}')
+        return added
+
+    def add_text(self, text, tags=None):
+        # Plain text: one target per line, blank lines and # comments are ignored,
+        # commas and spaces separate hosts when there are no tags on the line
+        added = 0
+        for line in text.splitlines():
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            entries = [line] if '=' in line else line.replace(',', ' ').split()
+            for entry in entries:
+                try:
+                    host, port, entry_tags = parse_target(entry, self.default_port)
+                    self.add(host, port, **dict(tags or {}, **entry_tags))
+                    added += 1
+                except ValueError as err:
+                    logger.log(WARNING, f'Skipping target {entry}: {err}')
+        return added
+
+    def load(self, path, file_type=None, tags=None):
+        # file_type: 'json', 'yaml' or 'plain-text', guessed from the extension when not given.
+        # Returns the number of entries read, duplicates included
+        if file_type is None:
+            file_type = FILE_TYPES.get(os.path.splitext(path)[1].lower(), 'plain-text')
+        with open(path, 'r') as targets_file:
+            if file_type == 'json':
+                return self.add_document(json.load(targets_file), tags)
+            if file_type == 'yaml':
+                if yaml is None:
+                    raise ImportError('PyYAML is needed to read YAML target files')
+                return self.add_document(yaml.safe_load(targets_file) or [], tags)
+            return self.add_text(targets_file.read(), tags)
+
+    ## DNS methods
+    def resolve(self, max_workers=32):
+        # Resolves every target concurrently, returns the targets that didn't resolve
+        targets = list(self.targets.values())
+        if not targets:
+            return []
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets)), thread_name_prefix='mysqllib-dns') as executor:
+            addresses = executor.map(self.dns.resolve, [target['host'] for target in targets])
+            for target, address in zip(targets, addresses):
+                target['address'] = address
+        unresolved = [target for target in targets if target['address'] is None]
+        for target in unresolved:
+            logger.log(WARNING, f"Unable to resolve {target['host']}")
+        return unresolved
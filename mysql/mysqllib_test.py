@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+mysqllib_test.py:
+  Unit tests for the mysqllib helpers that don't need a live database
+
+Requirements:
+  - Python 3
+  - mysql-connector-python
+"""
+
+__version__     = "1.0"
+__author__      = "Jesus Alejandro Sanchez Davila"
+__maintainer__  = "Jesus Alejandro Sanchez Davila"
+__email__       = "jsanchez.consultant@gmail.com"
+__status__      = "Alpha"
+
+from time import perf_counter
+import io
+import os
+import sys
+import unittest
+
+# Add current path
+path = os.path.abspath(os.path.dirname(__file__))
+if not path in sys.path:
+  sys.path.insert(1, path)
+del path
+
+import mysqllib
+
+class StatementTypeTest(unittest.TestCase):
+    def test_leading_token(self):
+        self.assertEqual(mysqllib.statement_type("  -- note\n# other\n/* block */ select 1"), 'SELECT')
+        self.assertEqual(mysqllib.statement_type("/*!40101 SET NAMES utf8 */"), 'SET')
+        self.assertEqual(mysqllib.statement_type("(SELECT 1) UNION (SELECT 2)"), 'SELECT')
+        self.assertEqual(mysqllib.statement_type("/* unterminated SELECT 1"), '')
+        self.assertEqual(mysqllib.statement_type("-- only a comment"), '')
+
+    def test_no_backtracking(self):
+        # Whitespace and comments not followed by a statement used to backtrack exponentially
+        start = perf_counter()
+        self.assertEqual(mysqllib.statement_type(" " * 10000 + "1"), '')
+        self.assertEqual(mysqllib.statement_type(" " * 10000), '')
+        self.assertEqual(mysqllib.statement_type("    -- indented note\n" * 1000), '')
+        self.assertEqual(mysqllib.statement_type("-- a -- b -- c -- d\n" * 1000 + "1"), '')
+        self.assertLess(perf_counter() - start, 1)
+
+    def test_split_sql_comment_tail(self):
+        start = perf_counter()
+        script = "SELECT 1;\n" + "    -- indented note\n" * 1000 + "  \n\t\n"
+        self.assertEqual(list(mysqllib.split_sql(io.StringIO(script))), ['SELECT 1'])
+        self.assertLess(perf_counter() - start, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,6 +18,7 @@ __status__      = "Alpha"
 
 import mysqllib
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getpass
 import json
 import os
@@ -36,37 +37,36 @@ parser.add_argument('--schema', dest='dbSchema', default='', help='Schema to con
 parser.add_argument('-P', '--port', dest='dbPort', default=3306, help='Port to connect to the databases')
 parser.add_argument('-u', '--user', dest='dbUser', required=True, help='Username to connect to the databases')
 parser.add_argument('-p', '--password', dest='askForPassword', action='store_true', help='Username to connect to the databases')
+parser.add_argument('-r', '--reference', dest='dbReference', default='hekkamiahmsv1c.mylabserver.com', help='Reference database the others are compared against')
+parser.add_argument('-s', '--schemas', dest='dbSchemas', nargs='+', help='Schemas to compare (defaults to every non-system schema on the reference)')
+parser.add_argument('-t', '--threads', dest='threads', type=int, default=16, help='Hosts loaded concurrently')
+parser.add_argument('--cache', dest='cacheFile', help='JSON file to keep schema metadata snapshots in between runs')
+parser.add_argument('--fix-dir', dest='fixDir', help='Directory to write one fix script per drifted host to')
+parser.add_argument('--allow-drops', dest='allowDrops', action='store_true', help='Also generate DROP commands for objects missing on the reference')
 parser.add_argument("-v", "--verbosity", action="count", default=0)
 
 args = parser.parse_args()
 
 dbPswd = 'admin'
+if args.askForPassword:
+    dbPswd = getpass(prompt='Please enter the password: ')
+
+def connect(db_host):
+    db = mysqllib.Database(hostname=db_host, port=args.dbPort)
+    db.connect(username=args.dbUser,password=dbPswd,pool_size=2)
+    return db
+
 # Main algorythm
-for db_host in args.dbList:
-    db1 = mysqllib.Database(hostname=db_host, port=args.dbPort)
-    if args.askForPassword:
-        dbPswd = getpass(prompt='Please enter the password: ')
-    db1.connect(username=args.dbUser,password=dbPswd)
-    # print(db.is_connected())
-    # print(json.dumps(db.get_schemas(),indent=2))
-    # schema = mysqllib.Schema(database=db1, name='mydb')
-    # print(db.get_schema('mysql'))
-    # print(f"Schema info >>> Name: {schema.name} Charset: {schema.charset} Collation: {schema.collation}")
-    # print(json.dumps(db.get_users(), indent=2))
-    # print(json.dumps(db.get_user('<someuser>'), indent=2))
-    # print(json.dumps(schema.get_tables(), indent=2))
-    # print(json.dumps(schema.get_table('threads'), indent=2))
-    schemas = db1.get_schemas()
-    # print(schemas)
-    db2 = mysqllib.Database(hostname='hekkamiahmsv1c.mylabserver.com', port=args.dbPort)
-    db2.connect(username=args.dbUser,password=dbPswd)
-    diff_dict = {}
-    # for item in schemas:
-    #     if item['schema_name'].lower() not in ['mysql','information_schema','performance_schema','test','mydb','tgops','percona']:
-    #         sch = mysqllib.Schema(database=db1,name=item['schema_name'])
-    #         diff_dict[item['schema_name']] = sch.compare(db2)
-    # someschema = mysqllib.Schema(db1,'<SOME SCHEMA>')
-    # print(json.dumps(scomeschema.compare(database=db2),indent=2))
-    print(json.dumps(diff_dict,indent=2))
-    db1.disconnect()
-    db2.disconnect()
\ No newline at end of file
+with ThreadPoolExecutor(max_workers=args.threads) as executor:
+    databases = list(executor.map(connect, [args.dbReference] + args.dbList))
+reference = databases[0]
+replicas = [db for db in databases[1:] if db.is_connected()]
+cache = mysqllib.MetadataCache(args.cacheFile) if args.cacheFile else None
+diff_dict = mysqllib.compare_fleet(reference, replicas, schema_names=args.dbSchemas, max_workers=args.threads, cache=cache, allow_drops=args.allowDrops)
+if cache:
+    cache.save()
+if args.fixDir:
+    mysqllib.write_fix_scripts(diff_dict, args.fixDir)
+print(json.dumps(diff_dict,indent=2,default=str))
+for db in databases:
+    db.disconnect()